@@ -0,0 +1,189 @@
+import asyncio
+import socket
+import threading
+from debug_log import log, WARNING
+from private_formate import GesnsorInstruction, PendingCommands, split_frames
+from wifi_function import WifiFunction
+
+
+class GsensorProtocol(asyncio.Protocol):
+    # 在 data_received 內直接切封包, DA / AA / EV 交給 on_record, 其餘視為 ack 交給 on_ack
+    def __init__(self, on_record, on_ack, on_lost):
+        self.data = bytearray()
+        self.transport = None
+        self.on_record = on_record
+        self.on_ack = on_ack
+        self.on_lost = on_lost
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.data += data
+        records, pos = split_frames(self.data)
+        del self.data[:pos]
+
+        for record in records:
+            function_code = bytes(record[2:4])
+            if function_code in (b'DA', b'AA', b'EV'):
+                self.on_record(function_code, record)
+            else:
+                self.on_ack(function_code, record)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.on_lost(exc)
+
+
+class AsyncGsensor:
+    def __init__(self, host, port, on_record=None, rcvbuf_size=WifiFunction.DEFAULT_RCVBUF_SIZE):
+        self.host = host
+        self.port = port
+        self.rcvbuf_size = rcvbuf_size
+        self.on_record = on_record if on_record is not None else self.default_on_record
+        self.records = None
+        self.transport = None
+        self.protocol = None
+        self.loop = None
+        self.connect_count = 0
+        self.pending = PendingCommands(2 * GesnsorInstruction.TIME_OUT)
+
+    @property
+    def is_connect(self):
+        return self.transport is not None
+
+    def default_on_record(self, function_code, record):
+        if function_code == b'EV':
+            log(f'{bytes(record)}')
+        else:
+            self.records.put_nowait((function_code, record))
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.records = asyncio.Queue()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.rcvbuf_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_size)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (self.host, self.port)), GesnsorInstruction.TIME_OUT)
+        except BaseException:
+            sock.close()
+            raise
+
+        self.transport, self.protocol = await loop.create_connection(
+            lambda: GsensorProtocol(self.on_record, self.handle_ack, self.handle_lost), sock=sock)
+        self.loop = loop
+        self.connect_count += 1
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def handle_ack(self, function_code, record):
+        if not self.pending.resolve(record):
+            log('Unexpected ack =', bytes(record), level=WARNING)
+
+    def handle_lost(self, exc):
+        self.transport = None
+        self.pending.reset(ConnectionError(f'connection lost: {exc}'))
+
+    async def request(self, send_data, function_code, parse=GesnsorInstruction.parse_ack,
+                      timeout=GesnsorInstruction.TIME_OUT):
+        # 逾時時 wait_for 會取消 Future, 但仍留在 pending 內, 之後才到的 ack 會被丟掉
+        if self.transport is None:
+            raise ConnectionError('not connected')
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.add(function_code, future, parse)
+        self.transport.write(send_data)
+        return await asyncio.wait_for(future, timeout)
+
+    async def start(self):
+        await self.request(GesnsorInstruction.build_command(b'ST'), b'ST')
+
+    async def stop(self):
+        await self.request(GesnsorInstruction.build_command(b'ED'), b'ED')
+
+    async def write_register(self, reg, data):
+        await self.request(GesnsorInstruction.build_write_register(reg, data), b'WM')
+
+    async def read_register(self, reg):
+        return await self.request(GesnsorInstruction.build_read_register(reg), b'RM',
+                                  GesnsorInstruction.parse_read_ack)
+
+    async def read_registers(self, regs=None):
+        # 全部的 RM 一次送出再一起等待 ack, 讀取失敗的 register 值為 None
+        regs = list(GesnsorInstruction.GsenAddress) if regs is None else list(regs)
+        results = await asyncio.gather(*[self.read_register(reg) for reg in regs], return_exceptions=True)
+        return {reg: None if isinstance(value, BaseException) else value for reg, value in zip(regs, results)}
+
+    def write(self, data):
+        if self.transport is not None:
+            self.transport.write(data)
+
+    def write_data(self, data, timeout=None):
+        # 給 event loop 以外的 thread 使用 (與 WifiFunction.write_data 相同介面)
+        # transport 自己有 write buffer, 不會因為佇列滿而丟資料, timeout 不使用
+        if self.loop is None:
+            log('not connected, drop command', level=WARNING)
+            return False
+        self.loop.call_soon_threadsafe(self.write, data)
+        return True
+
+    def is_send_finish(self):
+        return self.transport is None or self.transport.get_write_buffer_size() == 0
+
+
+class EventLoopThread:
+    # 在背景 thread 執行 event loop, 多個感測器可以共用同一個
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def call(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class AsyncGsensorInstruction(GesnsorInstruction):
+    # GesnsorInstruction 的 asyncio 版本: 指令編碼、ack 對應、Future、register 快取與 metrics 都沿用
+    # GesnsorInstruction, 只把傳輸換成 AsyncGsensor (收到的封包在 event loop 上 dispatch, 送出交給 event loop)
+    def __init__(self, host, port, loop_thread=None):
+        self.loop_thread = loop_thread if loop_thread is not None else EventLoopThread()
+        self.sensor = AsyncGsensor(host, port, on_record=self.dispatch)
+        super().__init__(self.sensor)
+        # ack 由 AsyncGsensor.handle_ack 在 event loop 上對應, 兩邊共用同一份等待清單
+        self.pending = self.sensor.pending
+
+    def start_workers(self):
+        # 不需要 arrange_process, 封包由 GsensorProtocol 切好後交給 dispatch
+        self.event_process_handle = threading.Thread(target=self.enent_display, daemon=True).start()
+
+    @property
+    def is_connect(self):
+        return self.sensor.is_connect
+
+    def dispatch(self, function_code, record):
+        # 在 event loop 上執行, 不能等待
+        self.dispatch_records((record,), 0)
+
+    def connect(self):
+        try:
+            self.loop_thread.run(self.sensor.connect(), GesnsorInstruction.TIME_OUT + 1)
+        except Exception as e:
+            log(f'{type(e).__name__}: {e}')
+        return self.sensor.is_connect
+
+    def close(self):
+        self.loop_thread.call(self.sensor.close)
+
+    def is_send_finish(self):
+        return self.sensor.is_send_finish()
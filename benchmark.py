@@ -0,0 +1,551 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import queue
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import numpy as np
+from collector import DataCollector, decode_records
+from metrics import metrics
+from private_formate import GesnsorInstruction, split_frames
+from process_pipeline import ProcessDataCollector
+from recorder import CsvRecorder, BinaryRecorder
+from wifi_function import WifiFunction
+
+# 效能量測, 結果可以輸出成 JSON 與之前的版本比較:
+#   python benchmark.py                               全部執行
+#   python benchmark.py decode loopback --rates 2000 8000
+#   python benchmark.py --output result.json --compare baseline.json
+# *_per_s 越大越好; *_cpu_s 為該階段使用的 CPU 時間
+
+LOOPBACK_RATES = (1000, 2000, 4000, 8000)
+LOOPBACK_DURATION = 3.0
+
+
+def make_aa_stream(count, corrupt_every=0):
+    # 產生 AA (55 bytes) 封包串流, corrupt_every > 0 時每隔幾個封包插入一段沒有 START_CODE 的錯誤資料
+    frame = struct.pack('B B H f f f f f f f f f f f f H B',
+                        GesnsorInstruction.START_CODE, 53, (ord('A') << 8) + ord('A'),
+                        *[float(i) for i in range(12)], 0, GesnsorInstruction.END_CODE)
+    stream = bytearray()
+    for i in range(count):
+        if corrupt_every and i % corrupt_every == 0:
+            stream += bytes(range(4, 36))
+        stream += frame
+    return bytes(stream)
+
+
+def chunked(stream, size):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def legacy_split_data(data):
+    # 原本逐 byte 解析的實作, 只用來比較效能
+    i = 0
+    pass_records = []
+
+    while True:
+        try:
+            if i >= len(data):
+                data = bytearray()
+                break
+
+            if data[i] != GesnsorInstruction.START_CODE:
+                i += 1
+                continue
+
+            length = data[i + 1] + 1
+
+            if i + length + 1 > len(data):
+                data = data[i:]
+                break
+
+            if data[i + length] == GesnsorInstruction.END_CODE:
+                pass_records.append(data[i:i + length + 1])
+                i += length + 1
+            elif data[i + length + 1] == GesnsorInstruction.END_CODE:
+                pass_records.append(data[i:i + length + 1])
+                i += length + 2
+            else:
+                i += 1
+
+        except Exception as e:
+            data = data[i:]
+            break
+
+    return pass_records, data
+
+
+def bench_split_data(frames=200000, chunk_size=4096, corrupt_every=0):
+    chunks = chunked(make_aa_stream(frames, corrupt_every), chunk_size)
+    result = {'frames': frames, 'chunk_size': chunk_size, 'corrupt_every': corrupt_every}
+
+    data = bytearray()
+    count = 0
+    t0 = time.perf_counter()
+    for chunk in chunks:
+        data += chunk
+        records, data = legacy_split_data(data)
+        count += len(records)
+    legacy_time = time.perf_counter() - t0
+
+    data = bytearray()
+    count_new = 0
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    for chunk in chunks:
+        data += chunk
+        records, pos = split_frames(data)
+        del data[:pos]
+        count_new += len(records)
+    new_time = time.perf_counter() - t0
+    new_cpu = time.process_time() - cpu0
+
+    if count != count_new:
+        raise RuntimeError(f'frame count mismatch, legacy = {count}, new = {count_new}')
+
+    result['legacy_frames_per_s'] = count / legacy_time
+    result['split_frames_per_s'] = count_new / new_time
+    result['split_frames_cpu_s'] = new_cpu
+    result['speedup'] = legacy_time / new_time
+    return result
+
+
+def make_aa_blocks(rows, block_rows):
+    blocks = []
+    for start in range(0, rows, block_rows):
+        timestamps = np.arange(start, start + block_rows) * 0.0005
+        columns = [np.random.rand(block_rows).astype(np.float32) for _ in DataCollector.AA_FIELDS]
+        blocks.append((timestamps, columns))
+    return blocks
+
+
+def legacy_save_to_csv(file_path, header, batches):
+    # 原本每 50 ms 檢查資料夾 / 重新開檔 / 逐列寫入的方式, 只用來比較效能
+    for batch in batches:
+        folder_path = os.path.dirname(file_path)
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        file_exists = os.path.exists(file_path)
+        with open(file_path, mode='a', newline='') as file:
+            writer = csv.writer(file)
+            if not file_exists:
+                writer.writerow(header)
+            for row in batch:
+                writer.writerow(row)
+
+
+def bench_csv_writer(rows=200000, block_rows=100):
+    # block_rows = 100 相當於 2 kHz 時每 50 ms 寫一次
+    blocks = make_aa_blocks(rows, block_rows)
+    batches = [[[t, *[c[i] for c in columns]] for i, t in enumerate(timestamps.tolist())]
+               for timestamps, columns in blocks]
+    for batch in batches:
+        for row in batch:
+            row[1:] = [float(value) for value in row[1:]]
+    result = {'rows': rows, 'block_rows': block_rows}
+
+    with tempfile.TemporaryDirectory() as folder:
+        t0 = time.perf_counter()
+        legacy_save_to_csv(os.path.join(folder, 'legacy', 'data.csv'), DataCollector.AA_HEADER, batches)
+        legacy_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        cpu0 = time.process_time()
+        recorder = CsvRecorder(os.path.join(folder, 'recorder', 'data.csv'), DataCollector.AA_HEADER)
+        for timestamps, columns in blocks:
+            recorder.write_block(timestamps, columns)
+        recorder.close()
+        new_time = time.perf_counter() - t0
+        new_cpu = time.process_time() - cpu0
+
+        t0 = time.perf_counter()
+        recorder = BinaryRecorder(os.path.join(folder, 'binary', 'data.gsr'), DataCollector.AA_HEADER,
+                                  ['<f4'] * len(DataCollector.AA_FIELDS))
+        for timestamps, columns in blocks:
+            recorder.write_block(timestamps, columns)
+        recorder.close()
+        binary_time = time.perf_counter() - t0
+
+    result['legacy_rows_per_s'] = rows / legacy_time
+    result['recorder_rows_per_s'] = rows / new_time
+    result['recorder_cpu_s'] = new_cpu
+    result['binary_rows_per_s'] = rows / binary_time
+    result['speedup'] = legacy_time / new_time
+    return result
+
+
+def make_da_records(count):
+    return [struct.pack('<B B H h h h H B', GesnsorInstruction.START_CODE, 11, (ord('A') << 8) + ord('D'),
+                        i % 1000, -i % 1000, 0, i & 0xFFFF, GesnsorInstruction.END_CODE) for i in range(count)]
+
+
+def run_collector(collector_class, records, file_path, **kwargs):
+    # 預先把封包放進佇列, 量測從開始解碼到檔案寫完的時間
+    instruction = types.SimpleNamespace(da_buf=queue.Queue(), aa_buf=queue.Queue())
+    for record in records:
+        instruction.da_buf.put(record)
+    collector = collector_class(DataCollector.PlotMethod.RAW_DATA.value, instruction, None, 2000, 0,
+                                file_path, **kwargs)
+
+    t0 = time.perf_counter()
+    collector.stop()
+    collector.collect_data()
+    collector.stop(None)
+    elapsed = time.perf_counter() - t0
+    if hasattr(collector, 'close'):
+        collector.close()
+    return elapsed
+
+
+def bench_pipeline_scaling(rows=400000, workers=(1, 2, 4)):
+    # 同一批 DA 封包分別用 thread 版與多 process 版解碼並寫成 CSV, 比較不同 worker 數的吞吐量
+    # 多 process 版包含啟動子 process 的時間
+    records = make_da_records(rows)
+    result = {'rows': rows, 'cpu_count': os.cpu_count()}
+
+    with tempfile.TemporaryDirectory() as folder:
+        elapsed = run_collector(DataCollector, records, os.path.join(folder, 'threads.csv'))
+        result['threads_rows_per_s'] = rows / elapsed
+        for count in workers:
+            elapsed = run_collector(ProcessDataCollector, records, os.path.join(folder, f'process_{count}.csv'),
+                                    workers=count)
+            result[f'process_{count}_rows_per_s'] = rows / elapsed
+    return result
+
+
+def bench_decode(frames=400000, batch=DataCollector.MAX_BATCH):
+    # collect_data 每批做的事: decode_records + 時間戳 + 交給寫檔佇列
+    records = make_da_records(frames)
+    batches = [records[i:i + batch] for i in range(0, frames, batch)]
+    result = {'frames': frames, 'batch': batch}
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    for records in batches:
+        decode_records(records, DataCollector.RAW_FIELDS)
+    result['decode_frames_per_s'] = frames / (time.perf_counter() - t0)
+    result['decode_cpu_s'] = time.process_time() - cpu0
+
+    instruction = types.SimpleNamespace(da_buf=queue.Queue(), aa_buf=queue.Queue())
+    collector = DataCollector(DataCollector.PlotMethod.RAW_DATA.value, instruction, None, 2000, 0, os.devnull)
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    for records in batches:
+        collector.process_records(records)
+    result['process_records_frames_per_s'] = frames / (time.perf_counter() - t0)
+    result['process_records_cpu_s'] = time.process_time() - cpu0
+    return result
+
+
+def bench_plot(rows=200000, block_rows=100, updates=200, frame_width=5, freq=2000):
+    # 繪圖視窗 (offscreen) 收資料與重畫的成本, 沒有 PyQt5 / pyqtgraph 時略過
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5 import QtWidgets
+        from plot_raw import FormGraphicsPlotRaw
+    except ImportError as e:
+        return {'skipped': f'{e}'}
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    window = FormGraphicsPlotRaw(frame_width, frame_width * freq)
+    window.scheduler.stop()
+    window.resize(1200, 600)
+    window.show()
+    app.processEvents()
+    result = {'rows': rows, 'block_rows': block_rows, 'updates': updates}
+
+    blocks = []
+    for start in range(0, rows, block_rows):
+        timestamps = np.arange(start, start + block_rows) / freq
+        blocks.append((timestamps, [np.sin(timestamps * k).astype(np.int16) for k in (50, 120, 200)]))
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    for timestamps, columns in blocks:
+        window.append_block(timestamps, columns)
+        window.ingest()
+    result['append_block_rows_per_s'] = rows / (time.perf_counter() - t0)
+    result['append_block_cpu_s'] = time.process_time() - cpu0
+
+    legacy_rows = min(rows, 20000)
+    timestamps = np.arange(legacy_rows) / freq
+    t0 = time.perf_counter()
+    for i, t in enumerate(timestamps.tolist()):
+        window.append_plot(t, i % 100, 0, 0)
+        window.ingest()
+    result['append_plot_rows_per_s'] = legacy_rows / (time.perf_counter() - t0)
+
+    costs = []
+    cpu0 = time.process_time()
+    for timestamps, columns in blocks[:updates]:
+        window.append_block(timestamps + rows / freq, columns)
+        window.ingest()
+        t0 = time.perf_counter()
+        window.update_plot()
+        app.processEvents()
+        costs.append(time.perf_counter() - t0)
+    result['update_plot_ms'] = float(np.mean(costs) * 1000)
+    result['update_plot_p95_ms'] = float(np.percentile(costs, 95) * 1000)
+    result['update_plot_cpu_s'] = time.process_time() - cpu0
+
+    window.close()
+    return result
+
+
+# thread 的 target 名稱對應到管線的階段
+THREAD_STAGES = {
+    'received_process': 'recv',
+    'arrange_process': 'arrange',
+    'collect_data': 'decode',
+    'save_to_csv': 'write',
+    'send_process': 'send',
+}
+
+
+def thread_cpu_times():
+    # 各階段 thread 使用的 CPU 秒數 (Linux 由 /proc/self/task 讀取, 其他平台回傳空的 dict)
+    tick = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    times = {}
+    for thread in threading.enumerate():
+        try:
+            with open(f'/proc/self/task/{thread.native_id}/stat') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError, TypeError):
+            continue
+        target = thread.name.rsplit('(', 1)[-1].rstrip(')')
+        stage = 'main' if thread is threading.main_thread() else THREAD_STAGES.get(target, 'other')
+        # utime / stime 為 stat 的第 14 / 15 個欄位, 去掉 pid 與名稱後為 index 11 / 12
+        times[stage] = times.get(stage, 0.0) + (int(fields[11]) + int(fields[12])) / tick
+    return times
+
+
+def start_emulator(rate):
+    # 模擬器放在另一個 process, CPU 量測只包含收集端
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_emulator.py'),
+                                '--port', '0', '--rate', str(rate)],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    port = int(line.rsplit(':', 1)[1])
+    threading.Thread(target=process.stdout.read, daemon=True).start()
+    return process, port
+
+
+def run_loopback(rate, duration):
+    emulator, port = start_emulator(rate)
+    wifi = WifiFunction('127.0.0.1', port)
+    instruction = GesnsorInstruction(wifi)
+    result = {'rate': rate}
+    try:
+        if not wifi.connect():
+            raise ConnectionError(f'cannot connect to emulator on port {port}')
+
+        with tempfile.TemporaryDirectory() as folder:
+            collector = DataCollector(DataCollector.PlotMethod.RAW_DATA.value, instruction, None, rate, 0,
+                                      os.path.join(folder, 'loopback.csv'))
+            collector_thread = threading.Thread(target=collector.collect_data, daemon=True)
+            collector_thread.start()
+            instruction.start()
+
+            # 跳過剛開始的暫態, 之後每 100 ms 記錄佇列深度
+            time.sleep(0.2)
+            metrics.reset_histograms('stage.')
+            threads0 = thread_cpu_times()
+            t0 = time.perf_counter()
+            cpu0 = time.process_time()
+            count0 = collector.sample_count
+            depths = []
+            while time.perf_counter() - t0 < duration:
+                time.sleep(0.1)
+                depths.append(collector.queue_hanle.qsize() + collector.data_queue.qsize())
+            elapsed = time.perf_counter() - t0
+            cpu = time.process_time() - cpu0
+            count = collector.sample_count - count0
+            threads = thread_cpu_times()
+            stages = metrics.snapshot()['histograms']
+
+            instruction.stop()
+            collector.stop()
+            collector_thread.join(DataCollector.STOP_TIME_OUT)
+    finally:
+        wifi.close()
+        emulator.terminate()
+        emulator.wait()
+
+    # 收到的速率達到 95% 且最後一秒的佇列沒有比前面更深, 視為可以持續
+    half = max(len(depths) // 2, 1)
+    result['frames_per_s'] = count / elapsed
+    result['cpu_percent'] = cpu / elapsed * 100
+    # 每個階段: thread 的 CPU 使用率與每批的處理時間
+    for stage, seconds in sorted(threads.items()):
+        result[f'cpu_{stage}_percent'] = (seconds - threads0.get(stage, 0.0)) / elapsed * 100
+    for name, summary in sorted(stages.items()):
+        if name.startswith('stage.') and summary['count']:
+            stage = name[len('stage.'):]
+            result[f'{stage}_batches'] = summary['count']
+            result[f'{stage}_mean_ms'] = summary['mean_ms']
+            result[f'{stage}_p95_ms'] = summary['p95_ms']
+    result['max_queue'] = max(depths, default=0)
+    result['final_queue'] = depths[-1] if depths else 0
+    result['sustainable'] = (count / elapsed >= rate * 0.95 and
+                             max(depths[-10:], default=0) <= max(max(depths[:half], default=0), rate * 0.05))
+    return result
+
+
+def bench_loopback(rates=LOOPBACK_RATES, duration=LOOPBACK_DURATION):
+    # 模擬器 -> TCP -> WifiFunction -> GesnsorInstruction -> DataCollector -> CSV 的完整路徑
+    result = {'duration': duration, 'max_sustainable_rate': 0}
+    for rate in rates:
+        run = run_loopback(rate, duration)
+        for key, value in run.items():
+            if key != 'rate':
+                result[f'{rate}hz_{key}'] = value
+        if run['sustainable']:
+            result['max_sustainable_rate'] = max(result['max_sustainable_rate'], rate)
+    return result
+
+
+def start_sink():
+    # 只負責收資料並計數的 TCP server, 模擬 CSV 來源模式下的裝置端
+    server = socket.create_server(('127.0.0.1', 0))
+    received = [0]
+
+    def run():
+        conn, _ = server.accept()
+        with conn:
+            buffer = bytearray(1 << 20)
+            while True:
+                size = conn.recv_into(buffer)
+                if size == 0:
+                    break
+                received[0] += size
+
+    threading.Thread(target=run, daemon=True).start()
+    return server, received
+
+
+def bench_send(frames=200000, batch=4096):
+    # CSV 來源模式 host -> 裝置的傳送: 逐筆 write_accel_raw 與 write_accel_raw_batch
+    server, received = start_sink()
+    wifi = WifiFunction('127.0.0.1', server.getsockname()[1])
+    instruction = GesnsorInstruction(wifi)
+    samples = np.arange(frames)
+    acc = (samples % 1000).astype(np.int16)
+    cnt = samples % 10000
+    size = GesnsorInstruction.DA_COMMAND_DTYPE.itemsize
+    result = {'frames': frames, 'batch': batch}
+    try:
+        if not wifi.connect():
+            raise ConnectionError('cannot connect to sink')
+
+        def wait_received(total):
+            while received[0] < total:
+                time.sleep(0.001)
+
+        t0 = time.perf_counter()
+        cpu0 = time.process_time()
+        for i in range(frames):
+            instruction.write_accel_raw(int(acc[i]), int(acc[i]), int(acc[i]), int(cnt[i]))
+        wait_received(frames * size)
+        result['single_frames_per_s'] = frames / (time.perf_counter() - t0)
+        result['single_cpu_s'] = time.process_time() - cpu0
+
+        t0 = time.perf_counter()
+        cpu0 = time.process_time()
+        for i in range(0, frames, batch):
+            instruction.write_accel_raw_batch(acc[i:i + batch], acc[i:i + batch], acc[i:i + batch], cnt[i:i + batch])
+        wait_received(2 * frames * size)
+        result['batch_frames_per_s'] = frames / (time.perf_counter() - t0)
+        result['batch_cpu_s'] = time.process_time() - cpu0
+    finally:
+        wifi.close()
+        server.close()
+    return result
+
+
+def compare_results(results, baseline, tolerance):
+    # 吞吐量 (*_per_s, max_sustainable_rate) 比基準低超過 tolerance 視為退步, 舊實作 (legacy_*) 不比較
+    regressions = []
+    for name, result in results.items():
+        for key, value in result.items():
+            if key.startswith('legacy_') or not (key.endswith('_per_s') or key == 'max_sustainable_rate'):
+                continue
+            base = baseline.get(name, {}).get(key)
+            if isinstance(base, (int, float)) and base > 0 and value < base * (1 - tolerance):
+                regressions.append(f'{name}.{key}: {value:,.2f} < {base:,.2f}')
+    return regressions
+
+
+BENCHMARKS = {
+    'split_data': bench_split_data,
+    'split_data_corrupt': lambda: bench_split_data(corrupt_every=10),
+    'csv_writer': bench_csv_writer,
+    'pipeline_scaling': bench_pipeline_scaling,
+    'decode': bench_decode,
+    'plot': bench_plot,
+    'loopback': bench_loopback,
+    'send': bench_send,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='G-sensor collector benchmarks')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run (default: all), one of {", ".join(BENCHMARKS)}')
+    parser.add_argument('--json', action='store_true', help='print one JSON line per benchmark')
+    parser.add_argument('--output', help='write all results and machine info to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from --output, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed throughput drop against the baseline')
+    parser.add_argument('--rates', type=int, nargs='+', default=list(LOOPBACK_RATES), help='loopback rates (Hz)')
+    parser.add_argument('--duration', type=float, default=LOOPBACK_DURATION, help='seconds per loopback rate')
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmark: {", ".join(unknown)}')
+
+    results = {}
+    for name in args.names or list(BENCHMARKS):
+        if name == 'loopback':
+            result = bench_loopback(args.rates, args.duration)
+        else:
+            result = BENCHMARKS[name]()
+        results[name] = result
+        if args.json:
+            print(json.dumps({'benchmark': name, **result}))
+        else:
+            print(f'[{name}]')
+            for key, value in result.items():
+                print(f'    {key:<32}{value:,.2f}' if isinstance(value, float) else f'    {key:<32}{value}')
+
+    if args.output:
+        report = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        regressions = compare_results(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
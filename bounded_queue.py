@@ -0,0 +1,155 @@
+import os
+import pickle
+import queue
+import tempfile
+from enum import Enum
+from metrics import metrics
+
+# 各階段之間的佇列都有上限, 長時間錄製時記憶體用量固定, 滿了之後的行為依 policy:
+# - block: 生產端等待 (put 給 timeout 時逾時丟出 queue.Full 並計入 dropped)
+# - drop-oldest: 丟掉最舊的一筆再放入, 生產端不會被擋住, 丟棄筆數計入 dropped
+# - spill: 超過上限的部分暫存到磁碟, 依原本順序讀回, 不丟資料
+# 每個佇列的深度 / 最高水位 / 丟棄 / 暫存筆數都記錄在 metrics:
+#   queue.<name>, queue.<name>.high_water, queue.<name>.dropped, queue.<name>.spilled
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    SPILL = 'spill'
+
+
+# name: (上限筆數, policy); 上限為 0 表示不限制
+DEFAULT_SETTINGS = {
+    'send': (1024, OverflowPolicy.BLOCK),
+    'da': (1 << 18, OverflowPolicy.DROP_OLDEST),
+    'aa': (1 << 16, OverflowPolicy.DROP_OLDEST),
+    'event': (1024, OverflowPolicy.DROP_OLDEST),
+    'data': (1024, OverflowPolicy.SPILL),
+    'csv_write': (1024, OverflowPolicy.SPILL),
+    'plot': (256, OverflowPolicy.DROP_OLDEST),
+}
+settings = dict(DEFAULT_SETTINGS)
+spill_dir = None
+
+
+def configure(name, maxsize=None, policy=None):
+    old_maxsize, old_policy = settings.get(name, (0, OverflowPolicy.BLOCK))
+    settings[name] = (old_maxsize if maxsize is None else maxsize,
+                      old_policy if policy is None else OverflowPolicy(policy))
+
+
+def configure_spill_dir(path):
+    global spill_dir
+    spill_dir = path
+
+
+def parse_setting(text):
+    # 'data=4096:spill' -> ('data', 4096, OverflowPolicy.SPILL), policy 可以省略
+    name, _, value = text.partition('=')
+    size, _, policy = value.partition(':')
+    if not name or not size:
+        raise ValueError(f'expected NAME=SIZE[:POLICY], got {text!r}')
+    return name, int(size), OverflowPolicy(policy) if policy else None
+
+
+class BoundedQueue(queue.Queue):
+    # 與 queue.Queue 相同介面, 既有的 put / get / qsize 呼叫不需要修改
+    def __init__(self, name, maxsize=None, policy=None):
+        default_maxsize, default_policy = settings.get(name, (0, OverflowPolicy.BLOCK))
+        self.name = name
+        self.limit = default_maxsize if maxsize is None else maxsize
+        self.policy = default_policy if policy is None else OverflowPolicy(policy)
+        self.high_water = 0
+        self.spill_file = None
+        self.spill_count = 0
+        self.spill_read_pos = 0
+        self.dropped = metrics.counter(f'queue.{name}.dropped')
+        self.spilled = metrics.counter(f'queue.{name}.spilled')
+        # 只有 block 交給 queue.Queue 處理上限, 其他 policy 在 _put 內處理, put 永遠不會等待
+        super().__init__(self.limit if self.policy == OverflowPolicy.BLOCK else 0)
+        metrics.gauge(f'queue.{name}', self.qsize)
+        metrics.gauge(f'queue.{name}.high_water', lambda: self.high_water)
+
+    def put(self, item, block=True, timeout=None):
+        try:
+            super().put(item, block, timeout)
+        except queue.Full:
+            self.dropped.add()
+            raise
+
+    def put_while(self, item, keep_waiting, interval):
+        # block policy 不設逾時的等待: 每 interval 秒檢查 keep_waiting(), 回傳 False 時才放棄
+        # 放棄時計入 dropped 並回傳 False, 等待中途不算丟棄
+        while True:
+            try:
+                super().put(item, True, interval)
+                return True
+            except queue.Full:
+                if not keep_waiting():
+                    self.dropped.add()
+                    return False
+
+    def _qsize(self):
+        return len(self.queue) + self.spill_count
+
+    def _put(self, item):
+        if self.limit and len(self.queue) >= self.limit:
+            if self.policy == OverflowPolicy.DROP_OLDEST:
+                self.queue.popleft()
+                # 被丟掉的那一筆不會有人呼叫 task_done
+                self.unfinished_tasks -= 1
+                self.dropped.add()
+            elif self.policy == OverflowPolicy.SPILL:
+                self.spill(item)
+                return
+        elif self.spill_count:
+            # 磁碟上還有較舊的資料, 新資料也要排在後面
+            self.spill(item)
+            return
+
+        self.queue.append(item)
+        size = self._qsize()
+        if size > self.high_water:
+            self.high_water = size
+
+    def _get(self):
+        item = self.queue.popleft()
+        if self.spill_count:
+            self.queue.append(self.unspill())
+        return item
+
+    def spill(self, item):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix=f'queue_{self.name}_', dir=spill_dir)
+        self.spill_file.seek(0, os.SEEK_END)
+        pickle.dump(item, self.spill_file, pickle.HIGHEST_PROTOCOL)
+        self.spill_count += 1
+        self.spilled.add()
+        size = self._qsize()
+        if size > self.high_water:
+            self.high_water = size
+
+    def unspill(self):
+        self.spill_file.seek(self.spill_read_pos)
+        item = pickle.load(self.spill_file)
+        self.spill_count -= 1
+        self.spill_read_pos = self.spill_file.tell()
+        if self.spill_count == 0:
+            # 全部讀回後清空檔案, 磁碟用量不會一直增加
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+            self.spill_read_pos = 0
+        return item
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+def high_water_marks(snapshot):
+    # 從 metrics snapshot 取出各佇列的最高水位, 結束時印出給長時間錄製參考
+    suffix = '.high_water'
+    return {name[len('queue.'):-len(suffix)]: value for name, value in snapshot['gauges'].items()
+            if name.startswith('queue.') and name.endswith(suffix)}
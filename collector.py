@@ -1,19 +1,116 @@
 import os
-import csv
-import time
 import threading
-import struct
 from enum import Enum
-from debug_log import log
+from debug_log import log, WARNING
 import queue
+import numpy as np
+from recorder import CsvRecorder, BinaryRecorder
+from metrics import metrics
+from bounded_queue import BoundedQueue
+from sequence_tracker import SequenceTracker, gap_marker_columns, insert_gap_markers
+
+
+# 封包格式: Start (u8), Len (u8), Function (u16), ..., Cnt (u16), End (u8)
+RECORD_DTYPES = {
+    13: np.dtype([('start', 'u1'), ('len', 'u1'), ('function', '<u2'),
+                  ('acc_x', '<i2'), ('acc_y', '<i2'), ('acc_z', '<i2'),
+                  ('cnt', '<u2'), ('end', 'u1')]),
+    19: np.dtype([('start', 'u1'), ('len', 'u1'), ('function', '<u2'),
+                  ('acc_x', '<i2'), ('acc_y', '<i2'), ('acc_z', '<i2'),
+                  ('gyro_x', '<i2'), ('gyro_y', '<i2'), ('gyro_z', '<i2'),
+                  ('cnt', '<u2'), ('end', 'u1')]),
+    55: np.dtype([('start', 'u1'), ('len', 'u1'), ('function', '<u2'),
+                  ('scale_x', '<f4'), ('scale_y', '<f4'), ('scale_z', '<f4'),
+                  ('ac_x', '<f4'), ('ac_y', '<f4'), ('ac_z', '<f4'),
+                  ('evl_up_x', '<f4'), ('evl_up_y', '<f4'), ('evl_up_z', '<f4'),
+                  ('evl_lo_x', '<f4'), ('evl_lo_y', '<f4'), ('evl_lo_z', '<f4'),
+                  ('cnt', '<u2'), ('end', 'u1')]),
+}
+
+
+def decode_records(records, fields):
+    # 把一批封包一次解成欄位陣列, 回傳 (columns, cnt), columns 依 fields 的順序
+    # 長度不符或缺少欄位的封包會略過
+    if not records:
+        return [np.empty(0) for _ in fields], np.empty(0, np.uint16)
+
+    data = b''.join(records)
+    return decode_runs(data, record_runs(records), fields)
+
+
+def record_runs(records):
+    # 連續且長度相同的封包合併成 [長度, 筆數]; 全部同長度時 (一般情況) 不用在 Python 逐筆檢查
+    sizes = list(map(len, records))
+    if sizes.count(sizes[0]) == len(sizes):
+        return [[sizes[0], len(sizes)]]
+
+    runs = []
+    for size in sizes:
+        if runs and runs[-1][0] == size:
+            runs[-1][1] += 1
+        else:
+            runs.append([size, 1])
+    return runs
+
+
+def decode_runs(data, runs, fields, offset=0):
+    # data[offset:] 為連續排列的封包, runs 為 record_runs 的結果, 不需要再切一次封包
+    blocks = []
+    for size, count in runs:
+        if size in RECORD_DTYPES:
+            blocks.append(np.frombuffer(data, RECORD_DTYPES[size], count, offset))
+        else:
+            log(f'Length Failure, len = {size}, data =', bytes(data[offset:offset + size]), level=WARNING)
+        offset += size * count
+
+    blocks = [block for block in blocks if all(field in block.dtype.names for field in fields)]
+    if not blocks:
+        return [np.empty(0) for _ in fields], np.empty(0, np.uint16)
+    if len(blocks) == 1:
+        return [blocks[0][field] for field in fields], blocks[0]['cnt']
+    return ([np.concatenate([block[field] for block in blocks]) for field in fields],
+            np.concatenate([block['cnt'] for block in blocks]))
+
+
+
+def recorder_dtypes(fields, gap_markers=False):
+    # 錄製檔內各欄位的型別與封包內相同; 要插入 NaN 斷點時整數欄位改為 float32
+    size = 13 if all(field in RECORD_DTYPES[13].names for field in fields) else 55
+    dtypes = [RECORD_DTYPES[size].fields[field][0] for field in fields]
+    if gap_markers:
+        dtypes = [dtype if dtype.kind == 'f' else np.dtype('<f4') for dtype in dtypes]
+    return [dtype.str for dtype in dtypes]
+
+
+def open_recorder(file_path, fields, header, mode, freq, gap_markers=False):
+    # 副檔名為 .gsr 時錄成二進位檔, 其餘維持 CSV
+    if os.path.splitext(file_path)[1].lower() == BinaryRecorder.EXTENSION:
+        return BinaryRecorder(file_path, header, recorder_dtypes(fields, gap_markers), mode, freq)
+    return CsvRecorder(file_path, header)
 
         
 class DataCollector:
     class PlotMethod(Enum):
         RAW_DATA = "Raw Data"
         ALL_ACCEL = "All Acc Data"
+
+    RAW_FIELDS = ('acc_x', 'acc_y', 'acc_z')
+    AA_FIELDS = ('scale_x', 'scale_y', 'scale_z',
+                 'ac_x', 'ac_y', 'ac_z',
+                 'evl_up_x', 'evl_up_y', 'evl_up_z',
+                 'evl_lo_x', 'evl_lo_y', 'evl_lo_z')
+    RAW_HEADER = ['Time', 'Accel_X', 'Accel_Y', 'Accel_Z']
+    AA_HEADER = ['Time', 'Scale_X', 'Scale_Y', 'Scale_Z', 
+                 'AC_Couple_X', 'AC_Couple_Y', 'AC_Couple_Z', 
+                 'Evelope_Upper_X', 'Evelope_Upper_Y', 'Evelope_Upper_Z', 
+                 'Evelope_Low_X', 'Evelope_Low_Y', 'Evelope_Low_Z']
+    MAX_BATCH = 1000
+    STOP_TIME_OUT = 5
         
-    def __init__(self, data_mode, g_sensor_instruction, plot_function, freq, frame_width, file_path):
+    def __init__(self, data_mode, g_sensor_instruction, plot_function, freq, frame_width, file_path,
+                 counter_time=False, gap_markers=False, counter_modulus=SequenceTracker.DEFAULT_MODULUS):
+        # counter_time: 時間戳依封包的 cnt 計算, 掉資料時後面的時間不會往前偏移
+        # gap_markers: 掉資料的位置在錄製檔內插入一列 NaN
         self.plot_method = data_mode
         self.freq = freq
         self.frame_width = frame_width
@@ -22,111 +119,177 @@ class DataCollector:
 
         self.data = bytearray()
         self.sample_period = 1.0 / self.freq
-        self.data_queue = queue.Queue()
-        self.csv_write_queue = queue.Queue()
+        self.data_queue = BoundedQueue('data')
+        self.csv_write_queue = BoundedQueue('csv_write')
         self.is_collecting = False
+        self.is_stop_requested = False
         self.save_cnt = 0
         self.timestamp = 0
+        self.last_time = None
+        self.sample_count = 0
         self.g_sen_instruction = g_sensor_instruction
+        self.counter_time = counter_time
+        self.gap_markers = gap_markers
+        self.sequence = SequenceTracker(counter_modulus)
         
         self.lock = threading.Lock()
         self.save_csv_handle = threading.Thread(target=self.save_to_csv, daemon=True)
+
+        self.decode_time = metrics.histogram('stage.decode')
+        self.decode_errors = metrics.counter('decode.errors')
+        self.write_time = metrics.histogram('stage.write')
+        self.rows_written = metrics.counter('rows.written')
+        self.lost_samples = metrics.counter('sequence.lost')
+        self.duplicate_samples = metrics.counter('sequence.duplicates')
         
         if self.plot_method == DataCollector.PlotMethod.RAW_DATA.value:
             self.get_data = self.g_sen_instruction.da_buf.get
             self.queue_hanle = self.g_sen_instruction.da_buf
+            self.fields = DataCollector.RAW_FIELDS
+            self.header = DataCollector.RAW_HEADER
         else:
             self.get_data = self.g_sen_instruction.aa_buf.get
             self.queue_hanle = self.g_sen_instruction.aa_buf
+            self.fields = DataCollector.AA_FIELDS
+            self.header = DataCollector.AA_HEADER
             
     def collect_data(self):
         self.save_csv_handle.start()
-        
-        while self.is_collecting:
-            if self.queue_hanle.empty() == True:
-                time.sleep(0.001)
-                continue
-            
+
+        while True:
             try:
+                # 阻塞等待第一筆, 之後把已經到的資料一次取完; None 為結束訊號
+                records = []
+                is_end = False
                 data = self.get_data(True, None)
+                while True:
+                    if not data:
+                        is_end = True
+                        break
+                    records.append(data)
+                    if len(records) >= DataCollector.MAX_BATCH:
+                        break
+                    try:
+                        data = self.get_data(False)
+                    except queue.Empty:
+                        break
 
-                if not data:
-                    break  
-
-                if len(data) == 19:
-                    fmt = 'B B H h h h h h h H B'
-                elif len(data) == 13:
-                    fmt = 'B B H h h h H B'
-                elif len(data) == 55:
-                    fmt = 'B B H f f f f f f f f f f f f H B'
-                else:
-                    log(f'Length Failure, len = {len(data)}, data = {data}')
-                    continue
+                with self.decode_time.time():
+                    self.process_records(records)
 
-                unpacked = struct.unpack(fmt, data)
-
-                if self.plot_method == DataCollector.PlotMethod.RAW_DATA.value:
-                    ax, ay, az, cnt = unpacked[3:7]
-                    self.plot.append_plot(self.timestamp, ax, ay, az)
-                    acc = [self.timestamp, ax, ay, az]
-                else:
-                    scale_x, scale_y, scale_z, ac_x, ac_y, ac_z, evl_up_x, evl_up_y, evl_up_z, evl_lo_x, evl_lo_y, evl_lo_z, cnt = unpacked[3:16]
-                    acc = [self.timestamp,
-                        scale_x, scale_y, scale_z,
-                        ac_x, ac_y, ac_z,
-                        evl_up_x, evl_up_y, evl_up_z,
-                        evl_lo_x, evl_lo_y, evl_lo_z]
-                    self.plot.append_plot(self.timestamp, scale_x, scale_y, scale_z,
-                                          ac_x, ac_y, ac_z,
-                                          evl_up_x, evl_up_y, evl_up_z,
-                                          evl_lo_x, evl_lo_y, evl_lo_z)
-
-                self.data_queue.put(acc, True, None)
-                    
-                self.timestamp += self.sample_period
+                if is_end:
+                    break
             except Exception as e:
+                self.decode_errors.add()
                 log(f'{e}')
 
+        self.is_collecting = False
+        self.data_queue.put(None)
         log(f"Finish")
 
+    def stop(self, timeout=STOP_TIME_OUT):
+        # 結束訊號排在所有已收到的資料之後, 所以資料會先處理完才結束
+        if not self.is_stop_requested:
+            self.is_stop_requested = True
+            self.queue_hanle.put(None)
+        if self.save_csv_handle.ident is None:
+            return True
+        self.save_csv_handle.join(timeout)
+        return not self.save_csv_handle.is_alive()
+
+    def process_records(self, records):
+        columns, cnt = decode_records(records, self.fields)
+        count = len(cnt)
+        if count < len(records):
+            self.decode_errors.add(len(records) - count)
+        if count == 0:
+            return
+
+        timestamps, keep, gap_steps, last_time = self.sample_times(cnt)
+        if keep is not None:
+            columns = [column[keep] for column in columns]
+        if len(timestamps) == 0:
+            return
+
+        if self.plot is not None:
+            self.plot.append_block(timestamps, columns)
+        if self.gap_markers:
+            columns = gap_marker_columns(columns)
+        if gap_steps is not None:
+            timestamps, columns = insert_gap_markers(timestamps, columns, gap_steps, self.sample_period, last_time)
+        self.data_queue.put((timestamps, columns), True, None)
+
+    def sample_times(self, cnt):
+        # 依 cnt 檢查遺失 / 重複並算出時間戳, 回傳 (timestamps, keep, gap_steps, last_time):
+        # - keep: 要保留的封包 (沒有重複時為 None)
+        # - gap_steps: 要插入斷點時與前一筆的樣本差 (不插入時為 None)
+        # - last_time: 上一批最後一筆的時間, 給 insert_gap_markers 使用
+        lost = self.sequence.lost
+        duplicates = self.sequence.duplicates
+        index, keep, steps = self.sequence.update(cnt)
+        if self.sequence.lost != lost:
+            self.lost_samples.add(self.sequence.lost - lost)
+        if self.sequence.duplicates != duplicates:
+            self.duplicate_samples.add(self.sequence.duplicates - duplicates)
+            index = index[keep]
+            steps = steps[keep]
+        else:
+            keep = None
+
+        count = len(index)
+        if self.counter_time:
+            timestamps = index * self.sample_period
+        else:
+            timestamps = self.timestamp + np.arange(count) * self.sample_period
+            self.timestamp += count * self.sample_period
+        self.sample_count += count
+
+        last_time = self.last_time
+        if count:
+            self.last_time = timestamps[-1]
+        gap_steps = steps if self.gap_markers and self.sequence.lost != lost else None
+        return timestamps, keep, gap_steps, last_time
+
+    def open_recorder(self):
+        return open_recorder(self.file_path, self.fields, self.header, self.plot_method, self.freq, self.gap_markers)
+
     def save_to_csv(self):
-        while self.is_collecting or not self.csv_write_queue.empty():
+        try:
+            recorder = self.open_recorder()
+        except Exception as e:
+            log(f"CSV Open Error: {e}")
+            recorder = None
+
+        is_end = False
+        while not is_end:
             try:
-                time.sleep(0.05)
-
-                folder_path = os.path.dirname(self.file_path)
-                if not os.path.exists(folder_path):
-                    os.makedirs(folder_path)
-                    
-                file_exists = os.path.exists(self.file_path)
-                with open(self.file_path, mode='a', newline='') as file:
-                    writer = csv.writer(file)
-                    if not file_exists:
-                        if self.plot_method == DataCollector.PlotMethod.RAW_DATA.value:
-                            writer.writerow(['Time', 'Accel_X', 'Accel_Y', 'Accel_Z'])
-                        else:
-                            writer.writerow(['Time', 'Scale_X', 'Scale_Y', 'Scale_Z', 
-                                            'AC_Couple_X', 'AC_Couple_Y', 'AC_Couple_Z', 
-                                            'Evelope_Upper_X', 'Evelope_Upper_Y', 'Evelope_Upper_Z', 
-                                            'Evelope_Low_X', 'Evelope_Low_Y', 'Evelope_Low_Z'])
-                    data_to_write = []
-                    cnt = 0
-                    while True:
-                        try:
-                            temp = self.data_queue.get(True, 0.002)
-                            data_to_write.append(temp)
-                            
-                            if cnt > 500:
-                                break
-                            
-                        except Exception as e:
-                            break
-                        
-                    if len(data_to_write):
-                        for row in data_to_write:
-                            writer.writerow(row)
+                try:
+                    data_to_write = [self.data_queue.get(True, CsvRecorder.FLUSH_INTERVAL)]
+                except queue.Empty:
+                    if recorder is not None:
+                        recorder.flush_if_due()
+                    continue
+
+                while True:
+                    try:
+                        data_to_write.append(self.data_queue.get(False))
+                    except queue.Empty:
+                        break
+
+                if None in data_to_write:
+                    is_end = True
+                    data_to_write = [item for item in data_to_write if item is not None]
+
+                if recorder is not None:
+                    for timestamps, columns in data_to_write:
+                        with self.write_time.time():
+                            recorder.write_block(timestamps, columns)
+                        self.rows_written.add(len(timestamps))
 
             except Exception as e:
                 log(f"CSV Save Error: {e}")
-            
+
+        if recorder is not None:
+            recorder.close()
+        self.data_queue.close()
         log(f"Finish")
@@ -1,21 +1,191 @@
-import inspect
+import atexit
 import os
-from datetime import datetime
+import queue
+import sys
+import threading
+import time
 
-def log(*args, sep=' ', end='\n'):
+# 低負擔的 log:
+# - 呼叫端只取 frame、時間與組字串, 格式化時間與輸出都在背景 thread 完成
+# - 檔名 / 函式名稱依呼叫位置快取, 不再每次呼叫 inspect
+# - 依等級過濾, 每個呼叫位置各自限速, 被略過的筆數在下一次輸出時補上
+# - 預設輸出到 stdout, configure(file_path=...) 可改寫到會自動輪替的檔案
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+RATE_LIMIT = 10.0       # 每個呼叫位置每秒最多幾筆
+RATE_BURST = 20         # 短時間內允許的突發筆數
+MAX_PENDING = 10000     # 背景佇列上限, 滿了就丟棄並計數, 不讓呼叫端卡住
+MAX_BYTES = 10 << 20
+BACKUP_COUNT = 5
+
+
+class CallSite:
+    # 呼叫位置的快取資訊與限速狀態 (token bucket)
+    __slots__ = ('prefix', 'tokens', 'last', 'suppressed')
+
+    def __init__(self, frame):
+        filename = os.path.basename(frame.f_code.co_filename)
+        self.prefix = f'[{filename}:{frame.f_lineno}] {frame.f_code.co_name}()'
+        self.tokens = RATE_BURST
+        self.last = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self, now):
+        self.tokens = min(RATE_BURST, self.tokens + (now - self.last) * RATE_LIMIT)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.suppressed += 1
+        return False
+
+
+class LogWriter:
+    # 背景 thread: 格式化時間並寫到 stdout 或輪替的檔案
+    def __init__(self):
+        self.queue = queue.Queue(MAX_PENDING)
+        self.file = None
+        self.file_path = None
+        self.max_bytes = MAX_BYTES
+        self.backup_count = BACKUP_COUNT
+        self.console = True
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            # 一次把已經排隊的訊息都寫出去, None 表示要 flush
+            items = [self.queue.get()]
+            while items[-1] is not None and len(items) < 1000:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                lines = [self.format(item) for item in items if item is not None]
+                if self.dropped:
+                    lines.append(f'[log] {self.dropped} messages dropped, queue full\n')
+                    self.dropped = 0
+                if lines:
+                    self.write(''.join(lines))
+                if items[-1] is None:
+                    self.flush()
+            except Exception as e:
+                sys.stderr.write(f'log writer error: {e}\n')
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    @staticmethod
+    def format(item):
+        timestamp, level, prefix, message, end = item
+        timestr = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+        millis = int(timestamp * 1000) % 1000
+        level_str = '' if level == INFO else f' {LEVEL_NAMES.get(level, level)}'
+        return f'[{timestr}.{millis:03d}]{level_str} {prefix} {message}{end}'
+
+    def write(self, text):
+        if self.console:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        if self.file_path is not None:
+            if self.file is None:
+                folder_path = os.path.dirname(self.file_path)
+                if folder_path:
+                    os.makedirs(folder_path, exist_ok=True)
+                self.file = open(self.file_path, 'a', encoding='utf-8')
+            self.file.write(text)
+            if self.file.tell() >= self.max_bytes:
+                self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f'{self.file_path}.{i}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.file_path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.file_path, f'{self.file_path}.1')
+        else:
+            os.remove(self.file_path)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+
+level_threshold = INFO
+call_sites = {}
+writer = LogWriter()
+
+
+def configure(level=None, file_path=None, console=None, max_bytes=None, backup_count=None):
+    # file_path 給 '' 表示不再寫檔
+    global level_threshold
+    flush()
+    if level is not None:
+        level_threshold = level
+    if console is not None:
+        writer.console = console
+    if max_bytes is not None:
+        writer.max_bytes = max_bytes
+    if backup_count is not None:
+        writer.backup_count = backup_count
+    if file_path is not None:
+        if writer.file is not None:
+            writer.file.close()
+            writer.file = None
+        writer.file_path = file_path or None
+
+
+def log(*args, sep=' ', end='\n', level=INFO):
     """
     替代 print() 的除錯工具，會自動顯示目前的檔案、行號、函式名稱、時間戳（到毫秒）。
+    輸出在背景 thread 完成, 同一個呼叫位置過於頻繁時會被限速。
 
     使用範例：
         log("資料接收中", data)
+        log("封包錯誤", level=WARNING)
     """
-    frame = inspect.currentframe().f_back
-    filename = os.path.basename(inspect.getfile(frame))
-    lineno = frame.f_lineno
-    funcname = frame.f_code.co_name
+    if level < level_threshold:
+        return
+
+    frame = sys._getframe(1)
+    key = (frame.f_code, frame.f_lineno)
+    site = call_sites.get(key)
+    if site is None:
+        site = call_sites[key] = CallSite(frame)
+
+    if not site.allow(time.monotonic()):
+        return
+
+    message = sep.join(map(str, args))
+    if site.suppressed:
+        message += f' (suppressed {site.suppressed} similar)'
+        site.suppressed = 0
+    writer.put((time.time(), level, site.prefix, message, end))
+
 
-    timestr = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]  # 切掉最後3位，變成毫秒
+def flush(timeout=1.0):
+    # 等待背景 thread 把目前排隊的 log 寫完
+    writer.put(None)
+    deadline = time.monotonic() + timeout
+    while writer.queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
 
-    prefix = f"[{timestr}] [{filename}:{lineno}] {funcname}()"
 
-    print(prefix, *args, sep=sep, end=end)
+atexit.register(flush)
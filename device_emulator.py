@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import struct
+import sys
+import time
+import numpy as np
+from async_transport import EventLoopThread
+from collector import RECORD_DTYPES
+from debug_log import log
+from private_formate import GesnsorInstruction
+
+# 在本機模擬 G-sensor 的 TCP 協定, 沒有硬體時也能測試 / 壓測整套程式:
+#   python device_emulator.py --port 4061 --mode raw --rate 4000 --jitter 0.002 --corrupt 0.001
+# - ST / ED / WM / RM 依裝置格式回覆, register 讀寫都對應到內部的 register map
+# - ST 之後依 DATA_OUTPUT_RATE 送出 DA (13 bytes, 加 gyro 為 19 bytes) 或 AA (55 bytes) 封包
+# - DATA_SRC 為 CSV 時, 收到的 DA 指令 (SimulateCsv 送出) 直接轉成 DA 封包送回
+
+
+class DeviceEmulator:
+    GsenAddress = GesnsorInstruction.GsenAddress
+    ControlWordCmd = GesnsorInstruction.ControlWordCmd
+
+    VERSION = (1 << 16) | (2 << 8)
+    DEFAULT_RATE = 2000
+    SEND_INTERVAL = 0.005
+    DATA_SRC_CSV = 2
+
+    # 主機送出的指令長度 (含 Start / End)
+    REQUEST_SIZES = {b'ST': 4, b'ED': 4, b'RM': 6, b'WM': 10, b'DA': 12}
+    MODE_SIZES = {'raw': 13, 'gyro': 19, 'aa': 55}
+
+    DEFAULT_REGISTERS = {
+        GsenAddress.VERSION: VERSION,
+        GsenAddress.DATA_SRC: 0,
+        GsenAddress.DATA_OUTPUT_RATE: DEFAULT_RATE,
+        GsenAddress.MAC_CODE: 0x00A0B1C2,
+        GsenAddress.IMU_ACCEL_FSR: 16,
+        GsenAddress.IMU_GYRO_FSR: 2000,
+        GsenAddress.IMU_SAMPLE_RATE: 8000,
+        GsenAddress.IMU_RESOLUTION: 16,
+        GsenAddress.ENVELOPE_INTERVAL: 100,
+    }
+
+    def __init__(self, host='127.0.0.1', port=0, mode='raw', rate=None, jitter=0.0, corrupt=0.0,
+                 disconnect_after=0.0, seed=None, send_interval=SEND_INTERVAL):
+        # rate: 指定時固定使用這個輸出率, 否則依 DATA_OUTPUT_RATE register
+        # jitter: 每次送出前額外等待 0 ~ jitter 秒, 資料量依實際經過時間補齊 (會變成突發)
+        # corrupt: 每個封包被破壞的機率
+        # disconnect_after: 開始串流幾秒後強制斷線, 0 表示不斷線
+        if mode not in DeviceEmulator.MODE_SIZES:
+            raise ValueError(f'unknown mode {mode}')
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.rate = rate
+        self.jitter = jitter
+        self.corrupt = corrupt
+        self.disconnect_after = disconnect_after
+        self.send_interval = send_interval
+        self.random = np.random.default_rng(seed)
+        self.registers = dict(DeviceEmulator.DEFAULT_REGISTERS)
+        if rate is not None:
+            self.registers[DeviceEmulator.GsenAddress.DATA_OUTPUT_RATE] = rate
+
+        self.server = None
+        self.loop_thread = None
+        self.frames_sent = 0
+        self.frames_corrupted = 0
+        self.connections = 0
+
+    @property
+    def output_rate(self):
+        return self.rate or self.registers.get(DeviceEmulator.GsenAddress.DATA_OUTPUT_RATE) or DeviceEmulator.DEFAULT_RATE
+
+    async def serve(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def start(self):
+        # 在背景 event loop 執行, 回傳實際的 port (port 為 0 時由系統分配)
+        self.loop_thread = EventLoopThread()
+        return self.loop_thread.run(self.serve())
+
+    def close(self):
+        if self.loop_thread is None:
+            return
+
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
+
+        self.loop_thread.run(shutdown(), GesnsorInstruction.TIME_OUT)
+        self.loop_thread.close()
+        self.loop_thread = None
+
+    async def handle_client(self, reader, writer):
+        self.connections += 1
+        session = EmulatorSession(self, writer)
+        log(f'Client connect, {writer.get_extra_info("peername")}')
+        data = bytearray()
+        try:
+            while True:
+                chunk = await reader.read(4096)
+                if not chunk:
+                    break
+                data += chunk
+                pos = session.handle_requests(data)
+                del data[:pos]
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            session.stop_stream()
+            writer.close()
+            log(f'Client disconnect')
+
+    def make_ack(self, function_code):
+        return bytes([GesnsorInstruction.START_CODE, 3]) + function_code + bytes([GesnsorInstruction.END_CODE])
+
+    def make_read_ack(self, value):
+        return (bytes([GesnsorInstruction.START_CODE, 7]) + b'RM' +
+                struct.pack('<I', value & 0xFFFFFFFF) + bytes([GesnsorInstruction.END_CODE]))
+
+    def make_frames(self, index, count):
+        # 產生 count 個連續封包, index 為第一個的樣本序號; 波形為不同頻率的正弦波
+        size = DeviceEmulator.MODE_SIZES[self.mode]
+        frames = np.empty(count, RECORD_DTYPES[size])
+        frames['start'] = GesnsorInstruction.START_CODE
+        frames['len'] = size - 2
+        frames['end'] = GesnsorInstruction.END_CODE
+        frames['cnt'] = (index + np.arange(count)) & 0xFFFF
+        t = (index + np.arange(count)) / self.output_rate
+        wave = [np.sin(2 * np.pi * freq * t) for freq in (50, 120, 200)]
+
+        if self.mode == 'aa':
+            frames['function'] = (ord('A') << 8) | ord('A')
+            for axis, values in zip('xyz', wave):
+                frames[f'scale_{axis}'] = values + 1.0
+                frames[f'ac_{axis}'] = values
+                frames[f'evl_up_{axis}'] = np.abs(values)
+                frames[f'evl_lo_{axis}'] = -np.abs(values)
+        else:
+            frames['function'] = (ord('A') << 8) | ord('D')
+            for axis, values in zip('xyz', wave):
+                frames[f'acc_{axis}'] = values * 8000
+            if self.mode == 'gyro':
+                for axis, values in zip('xyz', wave):
+                    frames[f'gyro_{axis}'] = values * 2000
+
+        data = frames.tobytes()
+        if self.corrupt > 0:
+            data = self.corrupt_frames(data, size, count)
+        return data
+
+    def corrupt_frames(self, data, size, count):
+        # 被選中的封包把 End 改掉, 接收端會當成錯誤資料略過
+        hits = np.flatnonzero(self.random.random(count) < self.corrupt)
+        if len(hits) == 0:
+            return data
+        data = bytearray(data)
+        for i in hits:
+            data[i * size + size - 1] = 0xFF
+        self.frames_corrupted += len(hits)
+        return bytes(data)
+
+
+class EmulatorSession:
+    # 一個連線的狀態: 解析指令、回覆 ack、控制串流
+    def __init__(self, emulator, writer):
+        self.emulator = emulator
+        self.writer = writer
+        self.stream_task = None
+
+    def handle_requests(self, data):
+        # 回傳已處理到的位置, 不完整的指令留到下次
+        pos = 0
+        while True:
+            pos = data.find(GesnsorInstruction.START_CODE, pos)
+            if pos < 0:
+                return len(data)
+            if pos + 3 > len(data):
+                return pos
+
+            function_code = bytes(data[pos + 1:pos + 3])
+            size = DeviceEmulator.REQUEST_SIZES.get(function_code)
+            if size is None:
+                pos += 1
+                continue
+            if pos + size > len(data):
+                return pos
+            if data[pos + size - 1] != GesnsorInstruction.END_CODE:
+                pos += 1
+                continue
+
+            self.handle_request(function_code, bytes(data[pos:pos + size]))
+            pos += size
+
+    def handle_request(self, function_code, request):
+        emulator = self.emulator
+        if function_code == b'ST':
+            self.start_stream()
+            self.writer.write(emulator.make_ack(b'ST'))
+        elif function_code == b'ED':
+            self.stop_stream()
+            self.writer.write(emulator.make_ack(b'ED'))
+        elif function_code == b'RM':
+            reg, = struct.unpack_from('<H', request, 3)
+            self.writer.write(emulator.make_read_ack(emulator.registers.get(reg, 0)))
+        elif function_code == b'WM':
+            reg, value = struct.unpack_from('<H I', request, 3)
+            self.write_register(reg, value)
+            self.writer.write(emulator.make_ack(b'WM'))
+        elif function_code == b'DA':
+            # CSV 資料來源: 主機送來的樣本原樣轉成 DA 封包送回
+            if emulator.registers.get(DeviceEmulator.GsenAddress.DATA_SRC) == DeviceEmulator.DATA_SRC_CSV:
+                acc_x, acc_y, acc_z, cnt = struct.unpack_from('h h h H', request, 3)
+                self.writer.write(struct.pack('<B B 2s h h h H B', GesnsorInstruction.START_CODE, 11, b'DA',
+                                              acc_x, acc_y, acc_z, cnt, GesnsorInstruction.END_CODE))
+                emulator.frames_sent += 1
+
+    def write_register(self, reg, value):
+        emulator = self.emulator
+        if reg == DeviceEmulator.GsenAddress.CONTROL_WORD:
+            if value == DeviceEmulator.ControlWordCmd.TRANSMIT_START:
+                self.start_stream()
+            elif value == DeviceEmulator.ControlWordCmd.TRANSMIT_STOP:
+                self.stop_stream()
+            elif value == DeviceEmulator.ControlWordCmd.RESET_PARAMETER:
+                emulator.registers = dict(DeviceEmulator.DEFAULT_REGISTERS)
+            return
+        if reg in (DeviceEmulator.GsenAddress.VERSION, DeviceEmulator.GsenAddress.MAC_CODE):
+            return
+        emulator.registers[reg] = value
+
+    def start_stream(self):
+        # CSV 資料來源時由主機送資料, 不產生波形
+        if self.stream_task is not None:
+            return
+        if self.emulator.registers.get(DeviceEmulator.GsenAddress.DATA_SRC) == DeviceEmulator.DATA_SRC_CSV:
+            return
+        self.stream_task = asyncio.get_running_loop().create_task(self.stream())
+
+    def stop_stream(self):
+        if self.stream_task is not None:
+            self.stream_task.cancel()
+            self.stream_task = None
+
+    async def stream(self):
+        # 以開始時間為基準計算應送出的樣本數, sleep 誤差或 jitter 都會在下一次補齊
+        emulator = self.emulator
+        start = time.monotonic()
+        index = 0
+        while True:
+            delay = emulator.send_interval
+            if emulator.jitter > 0:
+                delay += emulator.random.random() * emulator.jitter
+            await asyncio.sleep(delay)
+
+            elapsed = time.monotonic() - start
+            if emulator.disconnect_after > 0 and elapsed >= emulator.disconnect_after:
+                log(f'Emulated disconnect after {elapsed:.1f} s')
+                self.writer.transport.abort()
+                return
+
+            target = int(elapsed * emulator.output_rate)
+            if target > index:
+                self.writer.write(emulator.make_frames(index, target - index))
+                emulator.frames_sent += target - index
+                index = target
+                await self.writer.drain()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='G-sensor TCP device emulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4061)
+    parser.add_argument('--mode', choices=list(DeviceEmulator.MODE_SIZES), default='raw')
+    parser.add_argument('--rate', type=int, help='fixed output rate, default follows DATA_OUTPUT_RATE')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random delay per send, seconds')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='probability of corrupting a frame')
+    parser.add_argument('--disconnect-after', type=float, default=0.0, help='drop the connection after streaming this long')
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args(argv)
+
+
+async def serve_forever(emulator):
+    port = await emulator.serve()
+    print(f'emulating {emulator.mode} device on {emulator.host}:{port}', flush=True)
+    async with emulator.server:
+        await emulator.server.serve_forever()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    emulator = DeviceEmulator(args.host, args.port, args.mode, args.rate, args.jitter, args.corrupt,
+                              args.disconnect_after, args.seed)
+    try:
+        asyncio.run(serve_forever(emulator))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import argparse
+import signal
+import sys
+import threading
+import time
+from collector import DataCollector
+import bounded_queue
+import debug_log
+from debug_log import log
+from metrics import metrics, snapshot_json
+from private_formate import GesnsorInstruction
+from process_pipeline import ProcessDataCollector
+from simulate_csv import SimulateCsv
+from wifi_function import WifiFunction
+
+# 不使用 Qt 的收集程式, 給沒有螢幕的機器使用:
+#   python headless.py --host 192.168.0.110 --mode aa --rate 2000 --duration 60 --output ./save_data/run.gsr
+
+DATA_SRC = {'IMU': 0, 'IMU CSV': 1, 'CSV': 2}
+MODES = {'raw': DataCollector.PlotMethod.RAW_DATA.value, 'aa': DataCollector.PlotMethod.ALL_ACCEL.value}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Headless G-sensor collector')
+    parser.add_argument('--host', default='192.168.0.110')
+    parser.add_argument('--port', type=int, default=4061)
+    parser.add_argument('--mode', choices=list(MODES), default='raw')
+    parser.add_argument('--rate', type=int, help='write DATA_OUTPUT_RATE before recording')
+    parser.add_argument('--source', choices=list(DATA_SRC), help='write DATA_SRC before recording')
+    parser.add_argument('--replay', help='CSV file streamed to the device in CSV source mode')
+    parser.add_argument('--replay-speed', type=float, help='replay at N x the CSV Time column instead of the output rate')
+    parser.add_argument('--duration', type=float, default=0, help='seconds to record, 0 = until SIGINT/SIGTERM')
+    parser.add_argument('--output', help='.csv or .gsr file (default ./save_data/<time>.csv)')
+    parser.add_argument('--pipeline', type=int, default=0, metavar='WORKERS',
+                        help='decode and write in WORKERS worker processes, 0 = threads in this process')
+    parser.add_argument('--counter-time', action='store_true', help='derive timestamps from the frame counter')
+    parser.add_argument('--gap-markers', action='store_true', help='insert a NaN row where frames were lost')
+    parser.add_argument('--metrics-json', action='store_true', help='print a JSON metrics snapshot every --stats-interval')
+    parser.add_argument('--log-file', help='write the log to this rotating file instead of stdout')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    parser.add_argument('--queue-limit', action='append', default=[], metavar='NAME=SIZE[:POLICY]',
+                        help=f'bound a pipeline queue ({", ".join(bounded_queue.DEFAULT_SETTINGS)}), '
+                             f'POLICY is one of {", ".join(policy.value for policy in bounded_queue.OverflowPolicy)}')
+    parser.add_argument('--spill-dir', help='directory for queues with the spill policy (default: system temp)')
+    parser.add_argument('--stats-interval', type=float, default=1.0, help='seconds between throughput reports')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    debug_log.configure(level=getattr(debug_log, args.log_level), file_path=args.log_file,
+                        console=args.log_file is None)
+    for setting in args.queue_limit:
+        name, maxsize, policy = bounded_queue.parse_setting(setting)
+        bounded_queue.configure(name, maxsize, policy)
+    if args.spill_dir:
+        bounded_queue.configure_spill_dir(args.spill_dir)
+    output = args.output or f'./save_data/{time.strftime("%Y%m%d_%H%M%S")}.csv'
+
+    wifi = WifiFunction(args.host, args.port)
+    instruction = GesnsorInstruction(wifi)
+    if not wifi.connect():
+        log(f'Connect Fail, {args.host}:{args.port}')
+        return 1
+
+    if args.source is not None:
+        instruction.write_register(GesnsorInstruction.GsenAddress.DATA_SRC, DATA_SRC[args.source])
+    if args.rate is not None:
+        instruction.write_register(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE, args.rate)
+
+    freq = instruction.read_register(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE)
+    if not freq:
+        freq = args.rate or 2000
+        log(f'DATA_OUTPUT_RATE read fail, use {freq} Hz')
+
+    if args.pipeline > 0:
+        collector = ProcessDataCollector(MODES[args.mode], instruction, None, freq, 0, output, args.pipeline,
+                                         counter_time=args.counter_time, gap_markers=args.gap_markers)
+    else:
+        collector = DataCollector(MODES[args.mode], instruction, None, freq, 0, output,
+                                  args.counter_time, args.gap_markers)
+    collector.is_collecting = True
+    collector_thread = threading.Thread(target=collector.collect_data, daemon=True)
+    collector_thread.start()
+    instruction.start()
+
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+
+    simulate_csv = None
+    if args.replay:
+        simulate_csv = SimulateCsv(args.replay, instruction, freq, args.replay_speed)
+        simulate_csv.start_transmit_data()
+
+    print(f'recording {args.mode} at {freq} Hz to {output}', flush=True)
+    start = time.monotonic()
+    last_time = start
+    last_count = 0
+    while not stop_event.is_set():
+        timeout = args.stats_interval
+        if args.duration > 0:
+            timeout = min(timeout, max(start + args.duration - time.monotonic(), 0))
+        stop_event.wait(timeout)
+
+        now = time.monotonic()
+        count = collector.sample_count
+        if args.metrics_json:
+            print(snapshot_json({'elapsed': now - start, 'samples': count, **metrics.snapshot()}), flush=True)
+        elif now > last_time:
+            print(f'{now - start:8.1f} s  {count:10d} samples  {(count - last_count) / (now - last_time):9.1f} samples/s  '
+                  f'queue {collector.queue_hanle.qsize()}', flush=True)
+        last_time = now
+        last_count = count
+
+        if args.duration > 0 and now - start >= args.duration:
+            break
+        if simulate_csv is not None and simulate_csv.is_finish:
+            break
+
+    instruction.stop()
+    if not collector.stop():
+        log(f'Collector stop timeout')
+    collector_thread.join(DataCollector.STOP_TIME_OUT)
+    if args.pipeline > 0:
+        collector.close()
+    wifi.close()
+
+    elapsed = time.monotonic() - start
+    print(f'total {collector.sample_count} samples in {elapsed:.1f} s ({collector.sample_count / max(elapsed, 1e-9):.1f} samples/s)')
+    if collector.sequence.lost or collector.sequence.duplicates:
+        print(f'lost {collector.sequence.lost} samples, {collector.sequence.duplicates} duplicates, '
+              f'{collector.sequence.resets} counter resets')
+    snapshot = metrics.snapshot()
+    print('queue high water: ' + ', '.join(f'{name} {value}' for name, value in
+                                           sorted(bounded_queue.high_water_marks(snapshot).items())))
+    dropped = {name: value for name, value in snapshot['counters'].items()
+               if name.startswith('queue.') and name.endswith('.dropped') and value}
+    if dropped:
+        print('queue dropped: ' + ', '.join(f'{name[len("queue."):-len(".dropped")]} {value}'
+                                           for name, value in sorted(dropped.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
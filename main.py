@@ -1,4 +1,4 @@
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
 from main_ui import Ui_MainWindow
 import sys
 from private_formate import GesnsorInstruction
@@ -12,6 +12,7 @@ import time
 from simulate_csv import SimulateCsv
 from enum import Enum
 from debug_log import log
+from metrics import metrics, format_status
 import os
 import math
 import queue
@@ -22,6 +23,12 @@ class MainWindow(QtWidgets.QMainWindow):
         IMU_CSV = "IMU CSV"
         CSV = "CSV"
 
+    # register 讀取完成 (在接收 thread 觸發), 透過 signal 回到 GUI thread 更新畫面
+    registers_read = QtCore.pyqtSignal(object)
+    # 收集端在背景 thread 結束後通知 GUI thread; CSV 重播結束時在 GUI thread 執行停止流程
+    collection_stopped = QtCore.pyqtSignal(bool)
+    simulate_csv_finished = QtCore.pyqtSignal()
+
     def __init__(self):
         super().__init__()
         self.ui = Ui_MainWindow()
@@ -41,6 +48,9 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.btnConnect.clicked.connect(self.btnConnect_clicked)
         self.ui.btnShow.clicked.connect(self.btnShow_clicked)
         self.ui.btnGetCSV.clicked.connect(self.btnGetCSV_clicked)
+        self.registers_read.connect(self.registers_read_done)
+        self.collection_stopped.connect(self.collection_stopped_done)
+        self.simulate_csv_finished.connect(self.btnStop_clicked)
 
         self.host = self.ui.txtIP.text()
         self.port = int(self.ui.txtPort.text())
@@ -54,12 +64,19 @@ class MainWindow(QtWidgets.QMainWindow):
         self.file_path = f'./save_data/{timestr}.csv'
         self.ui.lblSavePath.setText(self.file_path)
         self.is_connect = False
-
-        self.lock = threading.Lock()
+        self.collector = None
 
         self.wifi = WifiFunction(self.host, self.port)
         self.instruction = GesnsorInstruction(self.wifi)
 
+        # 每秒在狀態列顯示各階段的速率與佇列深度
+        self.metrics_timer = QtCore.QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_status)
+        self.metrics_timer.start(1000)
+
+    def update_status(self):
+        self.statusBar().showMessage(format_status(metrics.snapshot()))
+
     def btnGetCSV_clicked(self):
         self.get_csv_path, _ = QFileDialog.getOpenFileName(
             None,
@@ -90,41 +107,74 @@ class MainWindow(QtWidgets.QMainWindow):
             self.ui.lblConnectState.setStyleSheet('color: green')
             self.is_connect = True
 
-            self.freq = self.instruction.read_register(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE)
+            # 兩個 register 一次送出, 不在 GUI thread 等待 ack
+            # 讀 VERSION 同時用來確認裝置有回應, 一定要真的送出, 不能用快取
+            self.read_registers_later([GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE,
+                                       GesnsorInstruction.GsenAddress.VERSION], use_cache=False)
+
+    def read_registers_later(self, regs, use_cache=True):
+        futures = self.instruction.read_registers_async(regs, use_cache)
+        remain = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remain[0] -= 1
+                if remain[0] > 0:
+                    return
+            values = {reg: None if future.cancelled() or future.exception() else future.result()
+                      for reg, future in futures.items()}
+            self.registers_read.emit(values)
+
+        for future in futures.values():
+            future.add_done_callback(done)
+        self.expire_later(futures.values())
+
+    def expire_later(self, futures):
+        # 超過 TIME_OUT 還沒收到 ack 的指令取消掉
+        futures = list(futures)
+        QtCore.QTimer.singleShot(GesnsorInstruction.TIME_OUT * 1000,
+                                 lambda: [future.cancel() for future in futures])
+
+    def registers_read_done(self, values):
+        freq = values.get(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE)
+        if freq is not None:
+            self.freq = freq
             index = self.ui.cbbSampleRate.findText(str(self.freq))
             if index != -1:
                 self.ui.cbbSampleRate.setCurrentIndex(index)
             else:
                 print(f'cbbSampleRate no find value, freq={self.freq}')
 
-            version_code = self.instruction.read_register(GesnsorInstruction.GsenAddress.VERSION)
-            if version_code != None:
-                main_ver = (version_code >> 16) & 0xFFFF
-                sub_ver  = (version_code >> 8) & 0xFF
-                test_ver = version_code & 0xFF
-                if test_ver == 0:
-                    version_str = f"Version: {main_ver}.{sub_ver:03d}"
-                else:
-                    version_str = f"Version: {main_ver}.{sub_ver:03d}.{test_ver:03d}"
+        version_code = values.get(GesnsorInstruction.GsenAddress.VERSION)
+        if version_code != None:
+            main_ver = (version_code >> 16) & 0xFFFF
+            sub_ver  = (version_code >> 8) & 0xFF
+            test_ver = version_code & 0xFF
+            if test_ver == 0:
+                version_str = f"Version: {main_ver}.{sub_ver:03d}"
+            else:
+                version_str = f"Version: {main_ver}.{sub_ver:03d}.{test_ver:03d}"
 
-                self.ui.lblVersion.setText(version_str)
+            self.ui.lblVersion.setText(version_str)
 
-            else:
-                self.wifi.sock.close()
-                self.wifi.sock = None
-                log(f'Connect Fail')
+        elif GesnsorInstruction.GsenAddress.VERSION in values:
+            self.wifi.close()
+            self.is_connect = False
+            self.ui.lblConnectState.setStyleSheet('color: red')
+            log(f'Connect Fail')
 
     def btnStart_clicked(self):
         if self.wifi.sock == None:
             return
 
         if self.mode == DataCollector.PlotMethod.RAW_DATA.value:
-            self.plot_raw = FormGraphicsPlotRaw(self.frame_width, self.frame_width / self.sample_period, self.lock)
+            self.plot_raw = FormGraphicsPlotRaw(self.frame_width, self.frame_width / self.sample_period)
             self.plot_raw.show()
             self.collector = DataCollector(self.mode, self.instruction, self.plot_raw, self.freq,
                                 self.frame_width, self.file_path)
         else:
-            self.plot_aa = FormGraphicsPlotAa(self.frame_width, int(self.frame_width / self.sample_period), self.lock)
+            self.plot_aa = FormGraphicsPlotAa(self.frame_width, int(self.frame_width / self.sample_period))
             self.plot_aa.show()
             self.collector = DataCollector(self.mode, self.instruction, self.plot_aa, self.freq,
                                 self.frame_width, self.file_path)
@@ -132,30 +182,53 @@ class MainWindow(QtWidgets.QMainWindow):
         self.collector.is_collecting = True
         self.collector_thread = threading.Thread(target=self.collector.collect_data, daemon=True)
         self.collector_thread.start()
-        self.instruction.start()
+
+        # 不在 GUI thread 等待 ST 的 ack
+        future = self.instruction.start_async()
+        future.add_done_callback(
+            lambda future: future.cancelled() or future.exception() is None or
+            log(f'Start Ack Fail: {future.exception()}'))
+        self.expire_later([future])
 
         if self.data_src == MainWindow.GsenDataSrc.CSV.value:
-            self.simulate_csv = SimulateCsv(self.get_csv_path, self.instruction)
+            self.simulate_csv = SimulateCsv(self.get_csv_path, self.instruction, self.freq)
             self.monitor_simulate_csv_thread_handle = threading.Thread(target=self.monitor_simulate_csv, daemon=True).start()
             self.simulate_csv.start_transmit_data()
 
     def btnStop_clicked(self):
-        self.instruction.stop()
-
-        if self.data_src != MainWindow.GsenDataSrc.CSV.value:
-            while(self.collector.queue_hanle.empty() == False):
-                continue
+        if self.collector is None:
+            return
 
-        self.collector.is_collecting = False
-        self.collector.save_csv_handle.join()
-        self.collector_thread.join()
+        # 等待 ED 的 ack 與收集端寫完檔案都在背景 thread, 完成後由 collection_stopped 回到 GUI thread
+        future = self.instruction.stop_async()
+        self.expire_later([future])
+        self.ui.btnStart.setEnabled(False)
+        collector, collector_thread = self.collector, self.collector_thread
+        self.collector = None
+        threading.Thread(target=self.finish_collection, args=(future, collector, collector_thread),
+                         daemon=True).start()
+
+    def finish_collection(self, future, collector, collector_thread):
+        try:
+            future.result(GesnsorInstruction.TIME_OUT)
+        except Exception as e:
+            log(f'Stop Ack Fail: {type(e).__name__} {e}')
+
+        stopped = collector.stop()
+        collector_thread.join(DataCollector.STOP_TIME_OUT)
+        self.collection_stopped.emit(stopped)
+
+    def collection_stopped_done(self, stopped):
+        if not stopped:
+            log(f'Collector stop timeout')
+        self.ui.btnStart.setEnabled(True)
 
     def btnbtnSaveForder_clicked(self):
         timestr = time.strftime('%Y%m%d_%H%M%S')
         self.file_path, _ = QFileDialog.getSaveFileName(self,
             "Save File",
             f"./save_data/{timestr}.csv",          # 預設檔案名
-            "CSV Files (*.csv);;All Files (*)")   # 檔案過濾器
+            "CSV Files (*.csv);;Binary Recording (*.gsr);;All Files (*)")   # 檔案過濾器
         self.ui.lblSavePath.setText(self.file_path)
 
     def txtAddress_textChanged(self):
@@ -187,25 +260,24 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if self.is_connect:
             if self.data_src == MainWindow.GsenDataSrc.IMU.value:
-                self.instruction.write_register(GesnsorInstruction.GsenAddress.DATA_SRC, 0)
+                data_src = 0
             elif self.data_src == MainWindow.GsenDataSrc.IMU_CSV.value:
-                self.instruction.write_register(GesnsorInstruction.GsenAddress.DATA_SRC, 1)
+                data_src = 1
             else:
-                self.instruction.write_register(GesnsorInstruction.GsenAddress.DATA_SRC, 2)
+                data_src = 2
+            self.expire_later([self.instruction.write_register_async(GesnsorInstruction.GsenAddress.DATA_SRC, data_src)])
 
     def cbbSampleRate_currentIndexChanged(self):
         if self.is_connect:
             frequency = self.ui.cbbSampleRate.currentText()
             self.freq = int(frequency)
-            self.instruction.write_register(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE, self.freq)
+            self.expire_later([self.instruction.write_register_async(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE, self.freq)])
 
     def monitor_simulate_csv(self):
         while self.simulate_csv.is_finish == False:
             time.sleep(0.1)
 
-        self.collector.is_collecting = False
-        self.collector.save_csv_handle.join()
-        self.instruction.stop()
+        self.simulate_csv_finished.emit()
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
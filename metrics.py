@@ -0,0 +1,185 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# 各階段的計數器 / 量表 / 耗時分布, 用來判斷是哪個階段跟不上:
+#   recv (socket) -> read_ring -> arrange_process -> da_buf / aa_buf -> collect_data -> data_queue -> save_to_csv
+# 程式內用 metrics.counter('recv.bytes').add(n) 等方式記錄, snapshot() 取得目前的數值與每秒速率
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def add(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Gauge:
+    # 可以直接 set, 或給一個函式在 snapshot 時才讀取 (例如 queue.qsize)
+    def __init__(self, func=None):
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        if self.func is None:
+            return self.value
+        try:
+            return self.func()
+        except Exception:
+            return None
+
+
+class Histogram:
+    # 固定的對數刻度 bucket (秒), observe 只做一次 bisect, 百分位數由 bucket 上界估計
+    BUCKETS = [1e-6 * 2 ** (i / 2) for i in range(48)]
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def percentile(self, counts, count, q):
+        target = count * q
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if seen >= target and n:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return 0.0
+
+    def summary(self):
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.total
+            maximum = self.max
+        if count == 0:
+            return {'count': 0}
+        return {
+            'count': count,
+            'mean_ms': total / count * 1000,
+            'p50_ms': min(self.percentile(counts, count, 0.5), maximum) * 1000,
+            'p95_ms': min(self.percentile(counts, count, 0.95), maximum) * 1000,
+            'p99_ms': min(self.percentile(counts, count, 0.99), maximum) * 1000,
+            'max_ms': maximum * 1000,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.last_time = time.monotonic()
+        self.last_values = {}
+
+    def counter(self, name):
+        with self.lock:
+            if name not in self.counters:
+                self.counters[name] = Counter()
+            return self.counters[name]
+
+    def gauge(self, name, func=None):
+        # 同名的 gauge 再註冊時以新的函式為準 (例如重新建立 DataCollector)
+        with self.lock:
+            if name not in self.gauges:
+                self.gauges[name] = Gauge(func)
+            elif func is not None:
+                self.gauges[name].func = func
+            return self.gauges[name]
+
+    def histogram(self, name):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def reset_histograms(self, prefix=''):
+        # 只量測某一段期間的耗時分布時使用 (例如 benchmark 的每個速率)
+        with self.lock:
+            histograms = [histogram for name, histogram in self.histograms.items() if name.startswith(prefix)]
+        for histogram in histograms:
+            histogram.reset()
+
+    def snapshot(self):
+        # counters 回傳累計值與距上一次 snapshot 的每秒速率
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = dict(self.histograms)
+            now = time.monotonic()
+            elapsed = now - self.last_time
+            self.last_time = now
+            last_values = self.last_values
+            self.last_values = {name: counter.value for name, counter in counters.items()}
+
+        return {
+            'time': time.time(),
+            'interval': elapsed,
+            'counters': {name: value for name, value in self.last_values.items()},
+            'rates': {name: (value - last_values.get(name, 0)) / elapsed if elapsed > 0 else 0.0
+                      for name, value in self.last_values.items()},
+            'gauges': {name: gauge.read() for name, gauge in gauges.items()},
+            'histograms': {name: histogram.summary() for name, histogram in histograms.items()},
+        }
+
+
+metrics = MetricsRegistry()
+
+
+def snapshot_json(snapshot):
+    return json.dumps(snapshot, separators=(',', ':'))
+
+
+def format_status(snapshot):
+    # 狀態列用的一行摘要
+    rates = snapshot['rates']
+    gauges = snapshot['gauges']
+    frames = sum(rate for name, rate in rates.items() if name.startswith('frames.'))
+    dropped = sum(value for name, value in snapshot['counters'].items()
+                  if name.startswith('queue.') and name.endswith('.dropped'))
+    write = snapshot['histograms'].get('stage.write', {})
+    return (f"recv {rates.get('recv.bytes', 0) / 1024:.0f} KB/s | "
+            f"frames {frames:.0f}/s | "
+            f"rows {rates.get('rows.written', 0):.0f}/s | "
+            f"discard {snapshot['counters'].get('split.discarded_bytes', 0)} B | "
+            f"decode err {snapshot['counters'].get('decode.errors', 0)} | "
+            f"queue da {gauges.get('queue.da') or 0} aa {gauges.get('queue.aa') or 0} "
+            f"data {gauges.get('queue.data') or 0} drop {dropped} | "
+            f"write p95 {write.get('p95_ms', 0):.1f} ms")
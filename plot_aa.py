@@ -1,18 +1,17 @@
 from PyQt5 import QtCore, QtWidgets, uic
 from plot_aa_ui import Ui_formAaGraphics
-import pyqtgraph as pg
-from collections import deque
 from debug_log import log
+from plot_buffer import PlotRingBuffer, MinMaxDecimator, BlockExchange
+from refresh_scheduler import RefreshScheduler
 
 class FormGraphicsPlotAa(QtWidgets.QMainWindow):
-    def __init__(self, frame_width, frame_count, lock):
+    def __init__(self, frame_width, frame_count):
         super().__init__() # in python3, super(Class, self).xxx = super().xxx
         self.ui = Ui_formAaGraphics()
         self.ui.setupUi(self)
         
         self.frame_width = frame_width
         self.frame_count = frame_count
-        self.lock = lock
         
         self.plot_x = self.ui.widgetAaX.addPlot(title="Accel X")
         self.plot_x.showGrid(x=True, y=True)
@@ -41,71 +40,81 @@ class FormGraphicsPlotAa(QtWidgets.QMainWindow):
         self.curve_z_evlh = self.plot_z.plot(pen='b', name='Envelope Upper')
         self.curve_z_evll = self.plot_z.plot(pen='y', name='Envelope Lower')
         
-        self.time = deque(maxlen=self.frame_count)
-        self.scale_x = deque(maxlen=self.frame_count)
-        self.scale_y = deque(maxlen=self.frame_count)
-        self.scale_z = deque(maxlen=self.frame_count)
+        # 欄位: time, scale xyz, ac xyz, envelope upper xyz, envelope lower xyz
+        self.buffer = PlotRingBuffer(self.frame_count, 13)
+        self.exchange = BlockExchange()
+        self.decimator = MinMaxDecimator(self.frame_count, 13)
+        self.curves = [self.curve_x_scale, self.curve_y_scale, self.curve_z_scale,
+                       self.curve_x_ac, self.curve_y_ac, self.curve_z_ac,
+                       self.curve_x_evlh, self.curve_y_evlh, self.curve_z_evlh,
+                       self.curve_x_evll, self.curve_y_evll, self.curve_z_evll]
         
-        self.ac_x = deque(maxlen=self.frame_count)
-        self.ac_y = deque(maxlen=self.frame_count)
-        self.ac_z = deque(maxlen=self.frame_count)
-        
-        self.evlh_x = deque(maxlen=self.frame_count)
-        self.evlh_y = deque(maxlen=self.frame_count)
-        self.evlh_z = deque(maxlen=self.frame_count)
-        
-        self.evll_x = deque(maxlen=self.frame_count)
-        self.evll_y = deque(maxlen=self.frame_count)
-        self.evll_z = deque(maxlen=self.frame_count)
-        
-        self.timer = pg.QtCore.QTimer()
-        self.timer.timeout.connect(self.update_plot)
-        self.timer.start(int(1000 / 30))
+        # 工具列可以個別開關每一條曲線, 關掉的曲線不會 setData
+        self.toolbar = self.addToolBar('Curves')
+        self.curve_actions = []
+        for axis in ('X', 'Y', 'Z'):
+            for name in ('Scale', 'AC', 'Env Upper', 'Env Lower'):
+                action = self.toolbar.addAction(f'{axis} {name}')
+                action.setCheckable(True)
+                action.setChecked(True)
+                action.toggled.connect(self.curve_toggled)
+                self.curve_actions.append(action)
+            self.toolbar.addSeparator()
+        # 工具列依軸排列, 轉成與 self.curves 相同的順序 (scale xyz, ac xyz, ...)
+        self.curve_actions = [self.curve_actions[axis * 4 + kind] for kind in range(4) for axis in range(3)]
+
+        self.dirty = False
+        self.scheduler = RefreshScheduler(self)
+        self.scheduler.start()
         
     def append_plot(self, time, scale_x, scale_y, scale_z,
                     ac_x, ac_y, ac_z,
                     evlh_x, evlh_y, evlh_z,
                     evll_x, evll_y, evll_z):
-        with self.lock:
-            self.time.append(time)
-            self.scale_x.append(scale_x)
-            self.scale_y.append(scale_y)
-            self.scale_z.append(scale_z)
-            
-            self.ac_x.append(ac_x)
-            self.ac_y.append(ac_y)
-            self.ac_z.append(ac_z)
-            
-            self.evlh_x.append(evlh_x)
-            self.evlh_y.append(evlh_y)
-            self.evlh_z.append(evlh_z)
-            
-            self.evll_x.append(evll_x)
-            self.evll_y.append(evll_y)
-            self.evll_z.append(evll_z)
+        self.exchange.publish(([time], [scale_x], [scale_y], [scale_z],
+                               [ac_x], [ac_y], [ac_z],
+                               [evlh_x], [evlh_y], [evlh_z],
+                               [evll_x], [evll_y], [evll_z]))
             
+    def append_block(self, time, columns):
+        self.exchange.publish((time, *columns))
+
+    def ingest(self):
+        block = self.exchange.take()
+        if block is not None:
+            self.buffer.append(block)
+            self.decimator.append(block)
+            self.dirty = True
+
+    def curve_toggled(self):
+        for curve, action in zip(self.curves, self.curve_actions):
+            curve.setVisible(action.isChecked())
+        self.dirty = True
+
+    def showEvent(self, event):
+        self.dirty = True
+        super().showEvent(event)
+
+    def resizeEvent(self, event):
+        self.dirty = True
+        super().resizeEvent(event)
+
     def update_plot(self):
-        with self.lock:
-            try:
-                self.curve_x_scale.setData(list(self.time), list(self.scale_x))
-                self.curve_x_ac.setData(list(self.time), list(self.ac_x))
-                self.curve_x_evlh.setData(list(self.time), list(self.evlh_x))
-                self.curve_x_evll.setData(list(self.time), list(self.evll_x))
-                
-                self.curve_y_scale.setData(list(self.time), list(self.scale_y))
-                self.curve_y_ac.setData(list(self.time), list(self.ac_y))
-                self.curve_y_evlh.setData(list(self.time), list(self.evlh_y))
-                self.curve_y_evll.setData(list(self.time), list(self.evll_y))
-                
-                self.curve_z_scale.setData(list(self.time), list(self.scale_z))
-                self.curve_z_ac.setData(list(self.time), list(self.ac_z))
-                self.curve_z_evlh.setData(list(self.time), list(self.evlh_z))
-                self.curve_z_evll.setData(list(self.time), list(self.evll_z))
-                
-                if len(self.time) >= self.frame_count:
-                    self.plot_x.setXRange(max(self.time[-1] - self.frame_width, 0), self.time[-1])
-                    self.plot_y.setXRange(max(self.time[-1] - self.frame_width, 0), self.time[-1])
-                    self.plot_z.setXRange(max(self.time[-1] - self.frame_width, 0), self.time[-1])
-            except Exception as e:
-                log(f'{e}')
-      
\ No newline at end of file
+        try:
+            width = int(self.plot_x.getViewBox().width())
+            if width > 0 and width != self.decimator.pixels:
+                self.decimator.rebuild(self.buffer.view(), width)
+
+            data = self.decimator.view()
+            time = data[0]
+            for curve, action, values in zip(self.curves, self.curve_actions, data[1:]):
+                if action.isChecked():
+                    curve.setData(time, values)
+            
+            if len(self.buffer) >= self.frame_count:
+                last_time = self.buffer.last(0)
+                self.plot_x.setXRange(max(last_time - self.frame_width, 0), last_time)
+                self.plot_y.setXRange(max(last_time - self.frame_width, 0), last_time)
+                self.plot_z.setXRange(max(last_time - self.frame_width, 0), last_time)
+        except Exception as e:
+            log(f'{e}')
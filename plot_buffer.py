@@ -0,0 +1,143 @@
+import numpy as np
+from collections import deque
+from bounded_queue import settings
+from metrics import metrics
+
+
+class PlotRingBuffer:
+    # 預先配置的多欄位環形緩衝區, 每個值同時寫在 i 與 i + capacity 兩個位置,
+    # 所以最後 size 筆資料永遠是一段連續的記憶體, 可以直接把 view 交給 setData
+    def __init__(self, capacity, columns, dtype=np.float64):
+        self.capacity = max(int(capacity), 1)
+        self.data = np.zeros((columns, 2 * self.capacity), dtype)
+        self.head = 0
+        self.size = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+        self.total = 0
+
+    def append(self, columns):
+        # columns: 每個欄位一個陣列 (長度相同), 整塊寫入
+        count = len(columns[0])
+        if count == 0:
+            return
+
+        skip = max(count - self.capacity, 0)
+        count -= skip
+        first = min(count, self.capacity - self.head)
+        second = count - first
+        head = self.head
+        capacity = self.capacity
+
+        for row, column in zip(self.data, columns):
+            values = np.asarray(column)[skip:]
+            row[head:head + first] = values[:first]
+            row[head + capacity:head + capacity + first] = values[:first]
+            if second:
+                row[:second] = values[first:]
+                row[capacity:capacity + second] = values[first:]
+
+        self.head = (head + count) % capacity
+        self.size = min(self.size + count, capacity)
+        self.total += count + skip
+
+    def view(self):
+        # 回傳 (columns, size) 的 view, 依時間順序排列
+        end = self.head + self.capacity
+        return self.data[:, end - self.size:end]
+
+    def last(self, column):
+        if self.size == 0:
+            return None
+        return self.data[column, self.head + self.capacity - 1]
+
+
+class MinMaxDecimator:
+    # 把視窗內的資料降到每個像素約 2 點: 每個 bucket 只保留最小值與最大值, 峰值不會消失
+    # 新資料進來時只處理新的完整 bucket, 不足一個 bucket 的資料留到下一次
+    DEFAULT_PIXELS = 1000
+
+    def __init__(self, window_count, columns, pixels=DEFAULT_PIXELS):
+        self.window_count = max(int(window_count), 1)
+        self.columns = columns
+        self.set_pixels(pixels)
+
+    def set_pixels(self, pixels):
+        self.pixels = max(int(pixels), 1)
+        self.bucket = max(self.window_count // self.pixels, 1)
+        if self.bucket == 1:
+            self.output = PlotRingBuffer(self.window_count + 1, self.columns)
+        else:
+            self.output = PlotRingBuffer(2 * (self.window_count // self.bucket + 1), self.columns)
+        self.pending = [np.empty(0) for _ in range(self.columns)]
+
+    def rebuild(self, columns, pixels):
+        # 繪圖寬度改變時才用完整的視窗資料重新計算
+        self.set_pixels(pixels)
+        self.append(columns)
+
+    def append(self, columns):
+        if self.bucket == 1:
+            self.output.append(columns)
+            return
+
+        bucket = self.bucket
+        data = [np.concatenate((pending, np.asarray(column, np.float64)))
+                for pending, column in zip(self.pending, columns)]
+        full = len(data[0]) // bucket * bucket
+        if full:
+            decimated = [np.repeat(data[0][:full:bucket], 2)]
+            for column in data[1:]:
+                blocks = column[:full].reshape(-1, bucket)
+                decimated.append(np.column_stack((blocks.min(axis=1), blocks.max(axis=1))).ravel())
+            self.output.append(decimated)
+        self.pending = [column[full:] for column in data]
+
+    def view(self):
+        return self.output.view()
+
+
+class BlockExchange:
+    # 收集端與 GUI 之間的單一生產者 / 單一消費者交換區, 不需要 lock:
+    # deque 的 append / popleft 本身是 thread-safe, 收集端只 publish 完整的區塊,
+    # GUI timer 觸發時一次取走全部, 繪圖期間不會擋住收集端
+    # GUI 跟不上時只保留最新的 limit 個區塊 (繪圖只需要最近的資料), 丟棄的數量記在 queue.plot.dropped
+    def __init__(self, limit=None):
+        self.limit = settings['plot'][0] if limit is None else limit
+        self.blocks = deque()
+        self.high_water = 0
+        self.dropped = metrics.counter('queue.plot.dropped')
+        metrics.gauge('queue.plot', lambda: len(self.blocks))
+        metrics.gauge('queue.plot.high_water', lambda: self.high_water)
+
+    def publish(self, columns):
+        if self.limit and len(self.blocks) >= self.limit:
+            try:
+                self.blocks.popleft()
+                self.dropped.add()
+            except IndexError:
+                pass
+        self.blocks.append(columns)
+        if len(self.blocks) > self.high_water:
+            self.high_water = len(self.blocks)
+
+    def take(self):
+        # 取走目前所有的區塊, 合併成一個區塊回傳; 沒有資料時回傳 None
+        blocks = []
+        while True:
+            try:
+                blocks.append(self.blocks.popleft())
+            except IndexError:
+                break
+
+        if not blocks:
+            return None
+        if len(blocks) == 1:
+            return blocks[0]
+        return [np.concatenate(column) for column in zip(*blocks)]
@@ -1,5 +1,5 @@
 # private_formate.py
-from debug_log import log
+from debug_log import log, DEBUG, WARNING
 import struct
 from wifi_function import WifiFunction
 import queue
@@ -7,11 +7,205 @@ import threading
 from enum import Enum
 from enum import IntEnum
 import time
+from collections import deque
+from concurrent.futures import Future
+from metrics import metrics
+from bounded_queue import BoundedQueue
+import numpy as np
+
+
+SPLIT_DISCARDED_BYTES = metrics.counter('split.discarded_bytes')
+SPLIT_RESYNCS = metrics.counter('split.resyncs')
+
+
+def _leading_run(data, value):
+    return len(data) - len(data.lstrip(bytes([value])))
+
+
+def split_frames(buf, pos=0, end=None, view=None):
+    # 一次切出 buf[pos:end] 內所有完整的封包, 回傳 (records, 下一次要開始解析的位置)
+    # 有給 view (buf 的 memoryview) 時回傳的封包是 view 的切片, 不會複製資料
+    # 封包格式: Start (u8), Len (u8), Function (u16), ..., End (u8)
+    # 遇到錯誤的資料時與逐 byte 解析的行為相同: 跳過 1 byte 後重新尋找 START_CODE
+    start_code = GesnsorInstruction.START_CODE
+    end_code = GesnsorInstruction.END_CODE
+    if end is None:
+        end = len(buf)
+    find = buf.find
+    source = buf if view is None else view
+    records = []
+    discarded = 0
+    resyncs = 0
+
+    try:
+        while True:
+            i = find(start_code, pos, end)
+            if i < 0:
+                discarded += end - pos
+                return records, end
+            discarded += i - pos
+
+            if i + 1 >= end:
+                return records, i
+
+            # 連續且長度相同的封包用 step slice 一次檢查 Start / Len / End, 不用逐筆判斷
+            size = buf[i + 1] + 2
+            count = (end - i) // size
+            if count >= GesnsorInstruction.BATCH_SPLIT_MIN:
+                last = i + count * size
+                n = min(_leading_run(buf[i:last:size], start_code),
+                        _leading_run(buf[i + 1:last:size], size - 2),
+                        _leading_run(buf[i + size - 1:last:size], end_code))
+                if n > 0:
+                    records += [source[j:j + size] for j in range(i, i + n * size, size)]
+                    pos = i + n * size
+                    continue
+
+            stop = i + size - 1
+            if stop >= end:
+                return records, i
+
+            if buf[stop] == end_code:
+                records.append(source[i:stop + 1])
+                pos = stop + 1
+            elif stop + 1 >= end:
+                return records, i
+            elif buf[stop + 1] == end_code:
+                records.append(source[i:stop + 1])
+                pos = stop + 2
+            else:
+                log('data =', buf[i:stop], level=WARNING)
+                pos = i + 1
+                discarded += 1
+                resyncs += 1
+    finally:
+        if discarded:
+            SPLIT_DISCARDED_BYTES.add(discarded)
+        if resyncs:
+            SPLIT_RESYNCS.add(resyncs)
+
+
+class PendingCommand:
+    __slots__ = ('function_code', 'future', 'parse', 'sent_time', 'maybe_answered')
+
+    def __init__(self, function_code, future, parse):
+        self.function_code = function_code
+        self.future = future
+        self.parse = parse
+        self.sent_time = time.monotonic()
+        # 前一筆相同 function code 的指令已取消, 卻吞掉了一個 ack: 那個 ack 可能其實是這一筆的
+        self.maybe_answered = False
+
+
+class PendingCommands:
+    # 已送出、等待 ack 的指令, 依送出順序排列
+    # 裝置依收到的順序回覆, 所以 ack 一律交給同 function code 中最舊的一筆, 即使那一筆已經逾時取消:
+    # 逾時後才到的 ack 在這裡丟掉, 不會被當成下一個相同 function code 的指令的回覆
+    # 但如果取消的那一筆的 ack 根本沒有回來 (lost ack), 它會吞掉下一筆的 ack, 之後每一筆都會錯開一個:
+    # - 取消的指令吞掉 ack 時, 後面同 function code 的下一筆標記 maybe_answered
+    #   這一筆如果也逾時取消, 表示被吞掉的就是它的 ack, 輪到它時直接移除, 下一個 ack 交給再下一筆
+    # - 已取消且送出超過 max_age 秒的指令不會再有 ack, 在 add / resolve 時移除
+    # 某一筆收到 ack 時, 排在它前面且已經取消的指令不會再有 ack 回來 (resync), 這時也一起移除
+    # Future 可以是 concurrent.futures.Future 或 asyncio.Future (由 event loop 呼叫 resolve)
+    def __init__(self, max_age=10):
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.max_age = max_age
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, function_code, future, parse):
+        with self.lock:
+            self.prune_expired()
+            self.items.append(PendingCommand(function_code, future, parse))
+
+    def prune_expired(self):
+        # 呼叫端需持有 lock
+        deadline = time.monotonic() - self.max_age
+        if any(item.future.done() and item.sent_time <= deadline for item in self.items):
+            self.items = deque(item for item in self.items
+                               if not (item.future.done() and item.sent_time <= deadline))
+
+    def take(self, function_code):
+        # 取出這個 ack 對應的指令, 沒有等待這個 function code 的指令時回傳 None; 呼叫端需持有 lock
+        while True:
+            for index, item in enumerate(self.items):
+                if item.function_code == function_code:
+                    break
+            else:
+                return None
+
+            earlier = [self.items.popleft() for _ in range(index)]
+            self.items.popleft()
+            self.items.extendleft(reversed([entry for entry in earlier if not entry.future.done()]))
+            if not (item.future.done() and item.maybe_answered):
+                return item
+            log('Skip command whose ack was already taken =', function_code, level=DEBUG)
+
+    def resolve(self, record):
+        # 沒有等待這個 function code 的指令時回傳 False
+        function_code = bytes(record[2:4])
+        with self.lock:
+            self.prune_expired()
+            item = self.take(function_code)
+            if item is None:
+                return False
+            if item.future.done():
+                for entry in self.items:
+                    if entry.function_code == function_code:
+                        entry.maybe_answered = True
+                        break
+
+        if item.future.done():
+            log('Late ack dropped =', bytes(record), level=DEBUG)
+            return True
+
+        try:
+            result = item.parse(record)
+        except Exception as e:
+            self.set_future(item.future, e, True)
+        else:
+            self.set_future(item.future, result, False)
+        return True
+
+    @staticmethod
+    def set_future(future, value, is_exception):
+        # 等待端可能剛好在這時逾時取消
+        try:
+            if is_exception:
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+        except Exception:
+            pass
+
+    def discard(self, futures, exc):
+        # 移除沒有送出的指令, 等待端立即收到 exc
+        with self.lock:
+            self.items = deque(item for item in self.items if item.future not in futures)
+        for future in futures:
+            PendingCommands.set_future(future, exc, True)
+
+    def reset(self, exc):
+        # 重新連線 / 斷線後舊的指令都不會再有 ack
+        with self.lock:
+            items = list(self.items)
+            self.items.clear()
+        for item in items:
+            if not item.future.done():
+                PendingCommands.set_future(item.future, exc, True)
+
 
 class GesnsorInstruction:
     TIME_OUT = 5
+    # 主機送出的 DA 指令 (CSV 資料來源): Start (u8), Function (2 bytes), Accel X/Y/Z (s16), Cnt (u16), End (u8)
+    DA_COMMAND_DTYPE = np.dtype([('start', 'u1'), ('function', 'S2'),
+                                 ('acc_x', '<i2'), ('acc_y', '<i2'), ('acc_z', '<i2'),
+                                 ('cnt', '<u2'), ('end', 'u1')])
     START_CODE = 0x02
     END_CODE = 0x03
+    BATCH_SPLIT_MIN = 2
 
     class GsenAddress(IntEnum):
         VERSION = 0
@@ -42,52 +236,87 @@ class GesnsorInstruction:
         SAVE_PARAMETER = 3
         ZERO_SET_ACCEL = 4
 
+    # register 快取的有效時間 (秒): None 表示不會變動 (STATIC), 0 表示每次都向裝置讀取
+    STATIC = None
+    DEFAULT_REGISTER_TTL = 300
+    REGISTER_TTL = {
+        GsenAddress.VERSION: STATIC,
+        GsenAddress.MAC_CODE: STATIC,
+        GsenAddress.ROBOT_COMMAND: 0,
+        GsenAddress.ROBOT_MOVE_STEP: 0,
+        GsenAddress.CONTROL_WORD: 0,
+        GsenAddress.STATUS_WORD: 0,
+        GsenAddress.OLD_PARAMETER_UPDATA: 0,
+    }
+
     def __init__(self, interface):
         self.data = bytearray()
         self.wifi = interface
-        self.event_buf = queue.Queue()
-        self.da_buf = queue.Queue()
-        self.aa_buf = queue.Queue()
-        self.ack_buf = queue.Queue()
+        self.event_buf = BoundedQueue('event')
+        self.da_buf = BoundedQueue('da')
+        self.aa_buf = BoundedQueue('aa')
+        self.frame_buffers = {b'DA': self.da_buf, b'AA': self.aa_buf, b'EV': self.event_buf}
+        self.pending = PendingCommands(2 * GesnsorInstruction.TIME_OUT)
+        self.connect_count = self.wifi.connect_count
+        # register 快取: {reg: (value, 讀取時間)}, 換連線對象時清空
+        self.register_cache = {}
+        self.register_cache_owner = None
+        self.register_cache_lock = threading.Lock()
+        self.frame_counters = {code: metrics.counter(f'frames.{code.decode()}') for code in (b'DA', b'AA', b'EV')}
+        self.ack_counter = metrics.counter('frames.ack')
+        self.arrange_time = metrics.histogram('stage.arrange')
+        self.start_workers()
+
+    def start_workers(self):
+        # 從 WifiFunction 的接收緩衝區切封包的 thread; AsyncGsensorInstruction 改由 event loop 呼叫 dispatch_records
         self.arrange_process_handle = threading.Thread(target=self.arrange_process, daemon=True).start()
         self.event_process_handle = threading.Thread(target=self.enent_display, daemon=True).start()
 
-    def split_data(self):
-        i = 0
-        pass_records = []
-
-        while True:
-            try:
-                if i >= len(self.data):
-                    self.data = bytearray()
-                    break
-
-                if self.data[i] != GesnsorInstruction.START_CODE:
-                    i += 1
-                    continue
-
-                length = self.data[i + 1] + 1
-
-                if i + length + 1 > len(self.data):
-                    self.data = self.data[i:]
-                    break
-
-                if self.data[i + length] == GesnsorInstruction.END_CODE:
-                    pass_records.append(self.data[i:i + length + 1])
-                    i += length + 1
-                elif self.data[i + length + 1] == GesnsorInstruction.END_CODE:
-                    pass_records.append(self.data[i:i + length + 1])
-                    i += length + 2
-                else:
-                    log(f'data = {self.data[i:i + length]}')
-                    i += 1
-
-            except Exception as e:
-                # log(f'{e}, data = {self.data[i:]}, i = {i}, len = {len(self.data)}')
-                self.data = self.data[i:]
-                break
+    @staticmethod
+    def build_command(function_code):
+        # Start (u8), Function (2 bytes, 例如 b'ST'), End (u8)
+        return bytes([GesnsorInstruction.START_CODE]) + function_code + bytes([GesnsorInstruction.END_CODE])
+
+    @staticmethod
+    def build_write_register(reg, data):
+        # 資料對應順序:
+        # Start (u8)
+        # Function (u16)
+        # Address (u16)
+        # Data (u32)
+        # End (u8)
+        part1 = struct.pack('>B H', GesnsorInstruction.START_CODE, (ord('W') << 8) + ord('M'))
+        part2 = struct.pack('<H I B', reg, data, GesnsorInstruction.END_CODE)
+        return part1 + part2
+
+    @staticmethod
+    def build_read_register(reg):
+        # 資料對應順序:
+        # Start (u8)
+        # Function (u16)
+        # Address (u16)
+        # End (u8)
+        part1 = struct.pack('>B H', GesnsorInstruction.START_CODE, (ord('R') << 8) + ord('M'))
+        part2 = struct.pack('<H B', reg, GesnsorInstruction.END_CODE)
+        return part1 + part2
+
+    @staticmethod
+    def encode_accel_raw(acc_x, acc_y, acc_z, cnt):
+        # 一次把多筆樣本編成連續的 DA 指令, 內容與逐筆呼叫 write_accel_raw 相同
+        frames = np.empty(len(cnt), GesnsorInstruction.DA_COMMAND_DTYPE)
+        frames['start'] = GesnsorInstruction.START_CODE
+        frames['function'] = b'DA'
+        frames['acc_x'] = acc_x
+        frames['acc_y'] = acc_y
+        frames['acc_z'] = acc_z
+        frames['cnt'] = cnt
+        frames['end'] = GesnsorInstruction.END_CODE
+        return frames.tobytes()
 
-        return pass_records
+    def split_data(self):
+        records, pos = split_frames(self.data)
+        del self.data[:pos]
+        return records
 
     def enent_display(self):
         while True:
@@ -95,142 +324,214 @@ class GesnsorInstruction:
             log(f'{data}')
 
     def arrange_process(self):
+        ring = self.wifi.read_ring
         while True:
             try:
-                if self.wifi.sock == None:
-                    continue
-
-                # if self.wifi.read_buf.empty() == True:
-                #     log(f'self.wifi.read_buf.empty')
-                #     continue
-
-                self.data += self.wifi.read_buf.get(True, None)
-
-                if not self.data:
-                    log(f'no data')
+                segment = ring.readable(None)
+                if segment is None:
                     continue
 
-                records = self.split_data()
-
-                for record in records:
-                    if len(record) == 0:
-                        log(f'no data')
-                        continue
-
-                    function_code = record[2:4]
-                    if bytes(function_code) == b'DA':
-                        self.da_buf.put(record, True, GesnsorInstruction.TIME_OUT)
-                    elif bytes(function_code) == b'AA':
-                        self.aa_buf.put(record, True, GesnsorInstruction.TIME_OUT)
-                    elif bytes(function_code) == b'EV':
-                        self.event_buf.put(record, True, GesnsorInstruction.TIME_OUT)
-                    else:
-                        log(f'data = {record}')
-                        self.ack_buf.put(record, True, GesnsorInstruction.TIME_OUT)
+                start, end = segment
+                begin = time.perf_counter()
+                records, pos = split_frames(ring.buf, start, end, ring.view)
+                try:
+                    self.dispatch_records(records)
+                finally:
+                    del records
+                    ring.release(pos, end)
+                    self.arrange_time.observe(time.perf_counter() - begin)
             except Exception as e:
                 log(f'{e}')
 
-    def start(self):
+    def dispatch_records(self, records, timeout=TIME_OUT):
+        # DA / AA / EV 放進對應的佇列, 其餘為 ack; records 可能指向接收緩衝區, 要離開這裡的封包才複製出來
+        # timeout 為 block policy 的佇列滿了時最多等待的時間, 在 event loop 上呼叫時給 0
+        counts = {b'DA': 0, b'AA': 0, b'EV': 0}
+        acks = 0
         try:
-            send_data = bytes([GesnsorInstruction.START_CODE, ord('S'), ord('T'), GesnsorInstruction.END_CODE])
-
-            self.wifi.write_data(send_data)
-
-            data = self.ack_buf.get(True, GesnsorInstruction.TIME_OUT)
-            fmt = 'B B H B'  # 這個格式對應於：Start, Len, function, End
-            unpacked = struct.unpack(fmt, data)
-            function_code = unpacked[2]
-
-            if function_code != ((ord('T') << 8) + ord('S')):
-                log('Ack Fail')
-        except Exception as e:
-            log(f'{e}')
+            for record in records:
+                function_code = bytes(record[2:4])
+                buffer = self.frame_buffers.get(function_code)
+                if buffer is None:
+                    self.resolve_ack(bytes(record))
+                    acks += 1
+                    continue
 
-    def stop(self):
+                counts[function_code] += 1
+                try:
+                    buffer.put(bytes(record), True, timeout)
+                except queue.Full:
+                    # 丟棄的筆數已記在 queue.<name>.dropped, 繼續處理後面的封包與 ack
+                    pass
+        finally:
+            for code, count in counts.items():
+                if count:
+                    self.frame_counters[code].add(count)
+            if acks:
+                self.ack_counter.add(acks)
+
+    def resolve_ack(self, record):
+        if not self.pending.resolve(record):
+            log('Unexpected ack =', record, level=WARNING)
+
+    def send_commands(self, commands):
+        # commands: [(send_data, function_code, parse), ...], 一次送出並回傳對應的 Future
+        # 送出前先登記, 確保 ack 回來時一定找得到等待者
+        # 重新連線過, 前一次連線還沒收到 ack 的指令都不會再有回覆
+        if self.connect_count != self.wifi.connect_count:
+            self.connect_count = self.wifi.connect_count
+            self.pending.reset(ConnectionError('reconnected'))
+
+        futures = []
+        for _, function_code, parse in commands:
+            future = Future()
+            self.pending.add(function_code, future, parse)
+            futures.append(future)
+
+        if not self.wifi.write_data(b''.join(send_data for send_data, _, _ in commands)):
+            # 沒有送出的指令不會有 ack, 不能留在 pending 裡吞掉之後的 ack
+            self.pending.discard(futures, ConnectionError('command not sent'))
+        return futures
+
+    def wait_result(self, future, timeout=TIME_OUT):
         try:
-            send_data = bytes([GesnsorInstruction.START_CODE, ord('E'), ord('D'), GesnsorInstruction.END_CODE])
-
-            self.wifi.write_data(send_data)
-
-            data = self.ack_buf.get(True, GesnsorInstruction.TIME_OUT)
-            fmt = 'B B H B'  # 這個格式對應於：Start, Len, function, End
-            unpacked = struct.unpack(fmt, data)
-            function_code = unpacked[2]
-
-            if function_code != ((ord('D') << 8) + ord('E')):
-                log('Ack Fail')
-
+            return future.result(timeout)
         except Exception as e:
-            log(f'{e}')
-
-    def write_register(self, reg, data):
-        try:
-            # 資料對應順序:
-            # Start (u8)
-            # Function (u16)
-            # Address (u16)
-            # Data (u32)
-            # End (u8)
-            start_code = GesnsorInstruction.START_CODE
-            end_code = GesnsorInstruction.END_CODE
-            function_code  = ((ord('W') << 8) + ord('M'))
-
-            part1 = struct.pack('>B H', start_code, function_code)
-            part2 = struct.pack('<H I B', reg, data, end_code)
-            send_data = part1 + part2
-
-            self.wifi.write_data(send_data)
+            future.cancel()
+            log(f'Ack Fail: {type(e).__name__} {e}')
+            return None
 
-            data = self.ack_buf.get(True, GesnsorInstruction.TIME_OUT)
-            fmt = 'B B H B'  # 這個格式對應於：Start, Len, function, End
-            unpacked = struct.unpack(fmt, data)
-            function_code = unpacked[2]
+    @staticmethod
+    def parse_ack(record):
+        return True
+
+    @staticmethod
+    def parse_read_ack(record):
+        # 資料對應順序:
+        # Start (u8)
+        # Len (u8)
+        # Function (u16)
+        # Data (u32)
+        # End (u8)
+        return struct.unpack_from('<I', record, 4)[0]
+
+    def start_async(self):
+        return self.send_commands([(GesnsorInstruction.build_command(b'ST'), b'ST', GesnsorInstruction.parse_ack)])[0]
+
+    def stop_async(self):
+        return self.send_commands([(GesnsorInstruction.build_command(b'ED'), b'ED', GesnsorInstruction.parse_ack)])[0]
+
+    def cached_register(self, reg):
+        ttl = GesnsorInstruction.REGISTER_TTL.get(reg, GesnsorInstruction.DEFAULT_REGISTER_TTL)
+        if ttl == 0:
+            return None
 
-            if function_code != ((ord('M') << 8) + ord('W')):
-                log('Ack Fail')
-        except Exception as e:
-            log(f"Exception: {e}")
+        with self.register_cache_lock:
+            self.check_register_owner()
+            item = self.register_cache.get(reg)
+            if item is None:
+                return None
+            value, read_time = item
+            if ttl is not GesnsorInstruction.STATIC and time.monotonic() - read_time > ttl:
+                del self.register_cache[reg]
+                return None
+            return value
+
+    def store_register(self, reg, value):
+        if GesnsorInstruction.REGISTER_TTL.get(reg, GesnsorInstruction.DEFAULT_REGISTER_TTL) == 0:
+            return
+        with self.register_cache_lock:
+            self.check_register_owner()
+            self.register_cache[reg] = (value, time.monotonic())
+
+    def check_register_owner(self):
+        # 換了連線目標 (host, port) 或重新連線過, 可能已經是另一台裝置 (同一個位址換了感測器),
+        # 連 STATIC 的 register 都不能再用舊的快取, 呼叫端需持有 register_cache_lock
+        owner = (self.wifi.host, self.wifi.port, self.wifi.connect_count)
+        if self.register_cache_owner != owner:
+            self.register_cache.clear()
+            self.register_cache_owner = owner
+
+    def invalidate_registers(self, regs=None, include_static=False):
+        # regs 為 None 時清除全部 (STATIC 的 register 要 include_static 才會清除)
+        with self.register_cache_lock:
+            for reg in list(self.register_cache if regs is None else regs):
+                ttl = GesnsorInstruction.REGISTER_TTL.get(reg, GesnsorInstruction.DEFAULT_REGISTER_TTL)
+                if include_static or ttl is not GesnsorInstruction.STATIC:
+                    self.register_cache.pop(reg, None)
+
+    def write_register_async(self, reg, data):
+        # write-through: 送出時先讓舊值失效, 收到 ack 後才寫入快取
+        # 快取在 parse 內更新, 等待 Future 的一方拿到結果時快取已經是新值
+        def parse(record):
+            if (reg == GesnsorInstruction.GsenAddress.CONTROL_WORD and
+                    data == GesnsorInstruction.ControlWordCmd.RESET_PARAMETER):
+                self.invalidate_registers()
+            else:
+                self.store_register(reg, data)
+            return GesnsorInstruction.parse_ack(record)
+
+        self.invalidate_registers([reg], include_static=True)
+        return self.send_commands([(GesnsorInstruction.build_write_register(reg, data), b'WM', parse)])[0]
+
+    def read_parser(self, reg):
+        # PendingCommands 只會對依順序對上、還在等待的指令呼叫 parse, 逾時後才到的 ack 不會寫入快取
+        def parse(record):
+            value = GesnsorInstruction.parse_read_ack(record)
+            self.store_register(reg, value)
+            return value
+        return parse
+
+    def read_register_async(self, reg, use_cache=True):
+        return self.read_registers_async([reg], use_cache)[reg]
+
+    def read_registers_async(self, regs=None, use_cache=True):
+        # 一次送出多個 RM, 回傳 {reg: Future}; regs 為 None 時讀取整個 GsenAddress
+        # 快取內還有效的 register 直接回傳已完成的 Future, 不會送到裝置
+        regs = list(GesnsorInstruction.GsenAddress) if regs is None else list(regs)
+        futures = {}
+        missing = []
+        for reg in regs:
+            value = self.cached_register(reg) if use_cache else None
+            if value is None:
+                missing.append(reg)
+            else:
+                futures[reg] = Future()
+                futures[reg].set_result(value)
 
-    def read_register(self, reg):
-        try:
-            # 資料對應順序:
-            # Start (u8)
-            # Function (u16)
-            # Address (u16)
-            # End (u8)
-            start_code = 0x02
-            end_code = 0x03
-            function_code  = (ord('R') << 8) + ord('M')
+        if missing:
+            sent = self.send_commands([(GesnsorInstruction.build_read_register(reg), b'RM',
+                                        self.read_parser(reg)) for reg in missing])
+            for reg, future in zip(missing, sent):
+                # 逾時 (wait_result 取消 Future) 時快取內的舊值也不再可信
+                future.add_done_callback(
+                    lambda future, reg=reg: future.cancelled() and
+                    self.invalidate_registers([reg], include_static=True))
+                futures[reg] = future
 
-            part1 = struct.pack('>B H', start_code, function_code)
-            part2 = struct.pack('<H B', reg, end_code)
-            send_data = part1 + part2
+        return {reg: futures[reg] for reg in regs}
 
-            self.wifi.write_data(send_data)
+    def start(self):
+        self.wait_result(self.start_async())
 
-            data = self.ack_buf.get(True, GesnsorInstruction.TIME_OUT)
-            fmt = 'B B H I B'
-            # 資料對應順序:
-            # Start (u8)
-            # Len (u8)
-            # Function (u16)
-            # Data (u32)
-            # End (u8)
-            unpacked = struct.unpack(fmt, data)
-            function_code, return_data = unpacked[2:4]
+    def stop(self):
+        self.wait_result(self.stop_async())
 
-            if function_code != ((ord('M') << 8) + ord('R')):
-                log('Ack Fail')
-            else:
-                return return_data
+    def write_register(self, reg, data):
+        self.wait_result(self.write_register_async(reg, data))
 
-        except Exception as e:
-            log(f"Exception: {e}")
-            return None
+    def read_register(self, reg, use_cache=True):
+        return self.wait_result(self.read_register_async(reg, use_cache))
 
+    def read_registers(self, regs=None, use_cache=True):
+        # 讀取失敗的 register 值為 None
+        futures = self.read_registers_async(regs, use_cache)
+        deadline = time.monotonic() + GesnsorInstruction.TIME_OUT
+        return {reg: self.wait_result(future, max(deadline - time.monotonic(), 0))
+                for reg, future in futures.items()}
 
     def is_send_finish(self):
-        return self.wifi.read_buf.empty()
+        return self.wifi.is_send_finish()
 
     def write_accel_raw(self, acc_x, acc_y, acc_z, cnt):
         try:
@@ -251,3 +552,16 @@ class GesnsorInstruction:
 
         except Exception as e:
             log(f"Exception: {e}")
+
+    def write_accel_raw_batch(self, acc_x, acc_y, acc_z, cnt):
+        # 多筆樣本一次編好放進單一 buffer, 送出時只佔 send_buf 一個項目
+        try:
+            return self.write_frames(GesnsorInstruction.encode_accel_raw(acc_x, acc_y, acc_z, cnt))
+        except Exception as e:
+            log(f"Exception: {e}")
+            return False
+
+    def write_frames(self, data):
+        # 送出已經編好的指令 (例如 encode_accel_raw 的結果), send_buf 滿時等待而不是丟掉
+        # 斷線而沒有送出時回傳 False
+        return self.wifi.write_data(data, None)
@@ -0,0 +1,248 @@
+import multiprocessing
+import os
+import queue
+import struct
+import threading
+import numpy as np
+from collector import DataCollector, decode_runs, open_recorder, record_runs, recorder_dtypes
+from debug_log import log
+from recorder import CsvRecorder, BinaryRecorder
+from sequence_tracker import SequenceTracker, gap_marker_columns, insert_gap_markers
+from shm_ring import SharedRing
+
+# 多 process 的解碼 / 寫檔管線, 避免切封包、解碼、CSV 格式化都在同一個直譯器搶 GIL:
+#   接收 (主 process) --frame ring--> 解碼 worker x N --block ring--> 寫檔 process
+#                                                   \--plot ring--> 主 process 的繪圖 thread
+# 每批封包依序輪流交給 worker, 寫檔端也依相同順序讀回, 所以寫入順序與收到的順序相同
+# worker 直接把資料格式化成錄製檔的內容 (CSV 文字或二進位記錄), 寫檔 process 只負責 write
+# cnt 的序號檢查與時間戳在主 process 依序計算 (與 DataCollector 相同), worker 只負責解碼與格式化
+
+# 送給 worker 的訊息: 標頭, runs (長度 u16, 筆數 u32), keep (u8 x 封包數), gap_steps (i64 x 樣本數),
+# timestamps (f64 x 樣本數), 連續的封包; keep / gap_steps 沒有時不送
+# 標頭: runs 數量, 可解碼的封包數, 樣本數 (u32), 有 keep, 有 gap_steps (u8), 上一批最後的時間 (f64, 沒有時為 NaN)
+FRAME_HEADER = struct.Struct('<IIIBBd')
+
+
+def decode_worker(frame_ring, block_ring, plot_ring, fields, header, is_binary, sample_period, gap_markers=False):
+    plot_dtype = BinaryRecorder.record_dtype(header, recorder_dtypes(fields))
+    dtype = BinaryRecorder.record_dtype(header, recorder_dtypes(fields, gap_markers))
+    while True:
+        block_sent = plot_sent = False
+        try:
+            message = frame_ring.get()
+            if not message:
+                break
+
+            # 主 process 已經切好封包, 這裡依 runs 直接解碼
+            run_count, valid, count, has_keep, has_steps, last_time = FRAME_HEADER.unpack_from(message)
+            offset = FRAME_HEADER.size
+            runs = list(struct.iter_unpack('<HI', memoryview(message)[offset:offset + 6 * run_count]))
+            offset += 6 * run_count
+            keep = None
+            if has_keep:
+                keep = np.frombuffer(message, np.bool_, valid, offset)
+                offset += valid
+            steps = None
+            if has_steps:
+                steps = np.frombuffer(message, np.int64, count, offset)
+                offset += 8 * count
+            timestamps = np.frombuffer(message, np.float64, count, offset)
+            offset += 8 * count
+
+            columns, _ = decode_runs(message, runs, fields, offset)
+            if keep is not None:
+                columns = [column[keep] for column in columns]
+
+            block = BinaryRecorder.encode_block(plot_dtype, timestamps, columns)
+            if gap_markers:
+                columns = gap_marker_columns(columns)
+            if steps is not None:
+                timestamps, columns = insert_gap_markers(timestamps, columns, steps, sample_period,
+                                                         None if np.isnan(last_time) else last_time)
+                count = len(timestamps)
+            if is_binary:
+                same = steps is None and dtype == plot_dtype
+                encoded = block if same else BinaryRecorder.encode_block(dtype, timestamps, columns)
+            else:
+                encoded = CsvRecorder.encode_block(timestamps, columns)
+            # 空的批次也要送, 寫檔端依輪流的順序讀取
+            block_ring.put(struct.pack('<Q', count), encoded)
+            block_sent = True
+            if plot_ring is not None:
+                plot_ring.put(struct.pack('<Q', count), block)
+                plot_sent = True
+        except Exception as e:
+            log(f'{e}')
+            # 解碼失敗的批次改送空的區塊, 寫檔端 / 繪圖端輪流讀取的順序才不會錯開
+            if not block_sent:
+                block_ring.put(struct.pack('<Q', 0))
+            if plot_ring is not None and not plot_sent:
+                plot_ring.put(struct.pack('<Q', 0))
+
+    block_ring.put_end()
+    if plot_ring is not None:
+        plot_ring.put_end()
+        plot_ring.close()
+    frame_ring.close()
+    block_ring.close()
+
+
+def writer_worker(block_rings, file_path, fields, header, mode, freq, gap_markers=False):
+    try:
+        recorder = open_recorder(file_path, fields, header, mode, freq, gap_markers)
+    except Exception as e:
+        log(f"CSV Open Error: {e}")
+        recorder = None
+
+    batch = 0
+    while True:
+        try:
+            message = block_rings[batch % len(block_rings)].get(CsvRecorder.FLUSH_INTERVAL)
+            if message is None:
+                if recorder is not None:
+                    recorder.flush_if_due()
+                continue
+            if not message:
+                break
+
+            batch += 1
+            count, = struct.unpack_from('<Q', message)
+            if recorder is not None and count:
+                recorder.write_encoded(memoryview(message)[8:], count)
+        except Exception as e:
+            log(f"CSV Save Error: {e}")
+
+    if recorder is not None:
+        recorder.close()
+    for ring in block_rings:
+        ring.close()
+    log(f"Finish")
+
+
+class ProcessDataCollector(DataCollector):
+    # 與 DataCollector 相同的使用方式 (collect_data / stop), 解碼與寫檔改在其他 process 執行
+    DECODE_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+    RING_CAPACITY = SharedRing.DEFAULT_CAPACITY
+
+    def __init__(self, data_mode, g_sensor_instruction, plot_function, freq, frame_width, file_path,
+                 workers=DECODE_WORKERS, ring_capacity=RING_CAPACITY,
+                 counter_time=False, gap_markers=False, counter_modulus=SequenceTracker.DEFAULT_MODULUS):
+        super().__init__(data_mode, g_sensor_instruction, plot_function, freq, frame_width, file_path,
+                         counter_time, gap_markers, counter_modulus)
+        self.workers = max(int(workers), 1)
+        self.dtype = BinaryRecorder.record_dtype(self.header, recorder_dtypes(self.fields))
+        self.frame_rings = [SharedRing(ring_capacity) for _ in range(self.workers)]
+        self.block_rings = [SharedRing(ring_capacity) for _ in range(self.workers)]
+        self.plot_rings = [SharedRing(ring_capacity) for _ in range(self.workers)] if self.plot is not None else []
+        self.batch = 0
+        self.processes = []
+        self.writer = None
+        self.plot_thread = None
+
+    def start_processes(self):
+        # spawn 與 Windows 的行為一致, 子 process 以名稱 attach 到共享記憶體
+        context = multiprocessing.get_context('spawn')
+        is_binary = os.path.splitext(self.file_path)[1].lower() == BinaryRecorder.EXTENSION
+        for i in range(self.workers):
+            plot_ring = self.plot_rings[i] if self.plot_rings else None
+            process = context.Process(target=decode_worker, daemon=True,
+                                      args=(self.frame_rings[i], self.block_rings[i], plot_ring,
+                                            self.fields, self.header, is_binary, self.sample_period,
+                                            self.gap_markers))
+            process.start()
+            self.processes.append(process)
+
+        self.writer = context.Process(target=writer_worker, daemon=True,
+                                      args=(self.block_rings, self.file_path, self.fields, self.header,
+                                            self.plot_method, self.freq, self.gap_markers))
+        self.writer.start()
+
+        if self.plot_rings:
+            self.plot_thread = threading.Thread(target=self.feed_plot, daemon=True)
+            self.plot_thread.start()
+
+    def collect_data(self):
+        self.start_processes()
+
+        while True:
+            try:
+                records = []
+                is_end = False
+                data = self.get_data(True, None)
+                while True:
+                    if not data:
+                        is_end = True
+                        break
+                    records.append(data)
+                    if len(records) >= DataCollector.MAX_BATCH:
+                        break
+                    try:
+                        data = self.get_data(False)
+                    except queue.Empty:
+                        break
+
+                if records:
+                    self.send_records(records)
+
+                if is_end:
+                    break
+            except Exception as e:
+                log(f'{e}')
+
+        for ring in self.frame_rings:
+            ring.put_end()
+        self.is_collecting = False
+        log(f"Finish")
+
+    def send_records(self, records):
+        ring = self.frame_rings[self.batch % self.workers]
+        data = b''.join(records)
+        runs = record_runs(records)
+        # 只用到 cnt (單一 run 時為不複製的 view) 檢查序號並算時間戳, 欄位的解碼與格式化留給 worker
+        _, cnt = decode_runs(data, runs, self.fields)
+        if len(cnt) < len(records):
+            self.decode_errors.add(len(records) - len(cnt))
+        timestamps, keep, gap_steps, last_time = self.sample_times(cnt)
+
+        parts = [FRAME_HEADER.pack(len(runs), len(cnt), len(timestamps), keep is not None, gap_steps is not None,
+                                   np.nan if last_time is None else last_time),
+                 struct.pack(f'<{"HI" * len(runs)}', *[value for run in runs for value in run])]
+        if keep is not None:
+            parts.append(keep.astype(np.bool_).tobytes())
+        if gap_steps is not None:
+            parts.append(gap_steps.astype(np.int64).tobytes())
+        parts += [timestamps.astype(np.float64).tobytes(), data]
+        ring.put(*parts)
+        self.batch += 1
+
+    def feed_plot(self):
+        names = self.dtype.names
+        batch = 0
+        while True:
+            message = self.plot_rings[batch % len(self.plot_rings)].get()
+            if not message:
+                break
+            batch += 1
+            block = np.frombuffer(message, self.dtype, offset=8)
+            if len(block):
+                self.plot.append_block(block[names[0]], [block[name] for name in names[1:]])
+
+    def stop(self, timeout=DataCollector.STOP_TIME_OUT):
+        if not self.is_stop_requested:
+            self.is_stop_requested = True
+            self.queue_hanle.put(None)
+        if self.writer is None:
+            return True
+        self.writer.join(timeout)
+        for process in self.processes:
+            process.join(timeout)
+        if self.plot_thread is not None:
+            self.plot_thread.join(timeout)
+        return not self.writer.is_alive()
+
+    def close(self):
+        for process in self.processes + ([self.writer] if self.writer is not None else []):
+            if process.is_alive():
+                process.terminate()
+        for ring in self.frame_rings + self.block_rings + self.plot_rings:
+            ring.close()
@@ -0,0 +1,209 @@
+import os
+import csv
+import io
+import sys
+import json
+import time
+import struct
+import numpy as np
+
+
+class CsvRecorder:
+    # 錄製期間只開一次檔, 以 writerows 整批寫入, 依時間 / 筆數 flush, close 時一定會 flush
+    BUFFER_SIZE = 1 << 20
+    FLUSH_INTERVAL = 1.0
+    FLUSH_ROWS = 20000
+
+    def __init__(self, file_path, header, buffer_size=BUFFER_SIZE,
+                 flush_interval=FLUSH_INTERVAL, flush_rows=FLUSH_ROWS):
+        self.file_path = file_path
+        self.header = header
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.rows_written = 0
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+
+        folder_path = os.path.dirname(self.file_path)
+        if folder_path:
+            os.makedirs(folder_path, exist_ok=True)
+
+        file_exists = os.path.exists(self.file_path) and os.path.getsize(self.file_path) > 0
+        self.file = open(self.file_path, mode='a', newline='', buffering=buffer_size)
+        self.writer = csv.writer(self.file)
+        if not file_exists:
+            self.writer.writerow(self.header)
+
+    def write_block(self, timestamps, columns):
+        count = len(timestamps)
+        self.writer.writerows(zip(timestamps.tolist(), *[column.tolist() for column in columns]))
+        self.written(count)
+
+    @staticmethod
+    def encode_block(timestamps, columns):
+        # 與 write_block 相同的文字內容, 給在其他 process 先格式化好的 pipeline 使用
+        text = io.StringIO()
+        csv.writer(text).writerows(zip(timestamps.tolist(), *[column.tolist() for column in columns]))
+        return text.getvalue().encode('utf-8')
+
+    def write_encoded(self, data, count):
+        self.file.write(str(data, 'utf-8'))
+        self.written(count)
+
+    def written(self, count):
+        self.rows_written += count
+        self.pending_rows += count
+
+        if self.pending_rows >= self.flush_rows:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.pending_rows and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+class BinaryRecorder:
+    # 固定長度記錄的二進位檔, 可以直接用 np.memmap 讀取, 不需要解析文字
+    # 檔案格式: MAGIC (8 bytes), header 長度 (u32), JSON header (補齊到 HEADER_ALIGN), 記錄...
+    MAGIC = b'GSENREC1'
+    HEADER_ALIGN = 64
+    EXTENSION = '.gsr'
+
+    def __init__(self, file_path, header, column_dtypes, mode='', sample_rate=0.0,
+                 buffer_size=CsvRecorder.BUFFER_SIZE, flush_interval=CsvRecorder.FLUSH_INTERVAL,
+                 flush_rows=CsvRecorder.FLUSH_ROWS):
+        self.file_path = file_path
+        self.header = header
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.rows_written = 0
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+        self.dtype = BinaryRecorder.record_dtype(header, column_dtypes)
+        self.info = {
+            'mode': mode,
+            'sample_rate': sample_rate,
+            'columns': list(header),
+            'dtype': [[name, self.dtype.fields[name][0].str] for name in self.dtype.names],
+        }
+
+        folder_path = os.path.dirname(self.file_path)
+        if folder_path:
+            os.makedirs(folder_path, exist_ok=True)
+
+        if os.path.exists(self.file_path) and os.path.getsize(self.file_path) > 0:
+            info, _ = read_binary_header(self.file_path)
+            if info['dtype'] != self.info['dtype']:
+                raise ValueError(f'{self.file_path} has a different record layout')
+            self.file = open(self.file_path, mode='ab', buffering=buffer_size)
+        else:
+            self.file = open(self.file_path, mode='ab', buffering=buffer_size)
+            self.file.write(pack_binary_header(self.info))
+
+    @staticmethod
+    def record_dtype(header, column_dtypes):
+        return np.dtype([(header[0], '<f8')] + list(zip(header[1:], column_dtypes)))
+
+    @staticmethod
+    def encode_block(dtype, timestamps, columns):
+        block = np.empty(len(timestamps), dtype)
+        names = dtype.names
+        block[names[0]] = timestamps
+        for name, column in zip(names[1:], columns):
+            block[name] = column
+        return block.tobytes()
+
+    def write_block(self, timestamps, columns):
+        self.write_encoded(BinaryRecorder.encode_block(self.dtype, timestamps, columns), len(timestamps))
+
+    def write_encoded(self, data, count):
+        self.file.write(data)
+        self.rows_written += count
+        self.pending_rows += count
+
+        if self.pending_rows >= self.flush_rows:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.pending_rows and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+def pack_binary_header(info):
+    text = json.dumps(info).encode('utf-8')
+    size = len(BinaryRecorder.MAGIC) + 4 + len(text)
+    size += -size % BinaryRecorder.HEADER_ALIGN
+    header = BinaryRecorder.MAGIC + struct.pack('<I', size) + text
+    return header + b' ' * (size - len(header))
+
+
+def read_binary_header(file_path):
+    # 回傳 (header 內容, 記錄開始的 offset)
+    with open(file_path, 'rb') as file:
+        magic = file.read(len(BinaryRecorder.MAGIC))
+        if magic != BinaryRecorder.MAGIC:
+            raise ValueError(f'{file_path} is not a binary recording')
+        size, = struct.unpack('<I', file.read(4))
+        text = file.read(size - len(BinaryRecorder.MAGIC) - 4)
+    return json.loads(text.decode('utf-8')), size
+
+
+def load_recording(file_path):
+    # 回傳 (header 內容, np.memmap), 錄製中的檔案也可以讀, 只取完整的記錄
+    info, offset = read_binary_header(file_path)
+    dtype = np.dtype([(name, type_str) for name, type_str in info['dtype']])
+    count = (os.path.getsize(file_path) - offset) // dtype.itemsize
+    if count == 0:
+        return info, np.zeros(0, dtype)
+    return info, np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def convert_to_csv(src_path, dst_path, block_rows=100000):
+    # 把二進位錄製檔轉回原本的 CSV 格式 (Time, Accel_X ...)
+    info, records = load_recording(src_path)
+    names = records.dtype.names
+    recorder = CsvRecorder(dst_path, info['columns'])
+    try:
+        for start in range(0, len(records), block_rows):
+            block = records[start:start + block_rows]
+            recorder.write_block(block[names[0]], [block[name] for name in names[1:]])
+    finally:
+        recorder.close()
+    return len(records)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(f'usage: python {os.path.basename(sys.argv[0])} <recording{BinaryRecorder.EXTENSION}> [output.csv]')
+        sys.exit(1)
+
+    src = sys.argv[1]
+    dst = sys.argv[2] if len(sys.argv) == 3 else os.path.splitext(src)[0] + '.csv'
+    rows = convert_to_csv(src, dst)
+    print(f'{rows} rows -> {dst}')
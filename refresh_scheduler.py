@@ -0,0 +1,59 @@
+import time
+from PyQt5 import QtCore
+
+
+class RefreshScheduler:
+    # 繪圖視窗的更新排程:
+    # - 每次觸發都先把收集端送來的資料收進緩衝區 (ingest), 避免視窗隱藏時資料堆積
+    # - 沒有新資料 (dirty 為 False)、視窗隱藏或最小化時不重畫
+    # - 重畫時間超過預算時自動降低更新率, 有餘裕時再慢慢回到目標更新率
+    TARGET_FPS = 30
+    MIN_FPS = 5
+    BUDGET_RATIO = 0.5
+
+    def __init__(self, window, target_fps=TARGET_FPS, min_fps=MIN_FPS):
+        self.window = window
+        self.min_interval = 1000.0 / target_fps
+        self.max_interval = 1000.0 / min_fps
+        self.interval = self.min_interval
+        self.last_cost = 0.0
+        self.skipped = 0
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.tick)
+
+    def start(self):
+        self.timer.start(int(self.interval))
+
+    def stop(self):
+        self.timer.stop()
+
+    @property
+    def fps(self):
+        return 1000.0 / self.interval
+
+    def tick(self):
+        self.window.ingest()
+
+        if not self.window.dirty or not self.window.isVisible() or self.window.isMinimized():
+            self.skipped += 1
+            return
+
+        start = time.perf_counter()
+        self.window.update_plot()
+        self.window.dirty = False
+        self.last_cost = (time.perf_counter() - start) * 1000.0
+        self.adjust(self.last_cost)
+
+    def adjust(self, cost):
+        budget = self.interval * RefreshScheduler.BUDGET_RATIO
+        if cost > budget:
+            interval = min(self.interval * 1.5, self.max_interval)
+        elif cost < budget / 4:
+            interval = max(self.interval / 1.25, self.min_interval)
+        else:
+            return
+
+        if int(interval) != int(self.interval):
+            self.timer.setInterval(int(interval))
+        self.interval = interval
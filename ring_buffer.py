@@ -0,0 +1,97 @@
+import threading
+from debug_log import log
+
+
+class ReceiveRingBuffer:
+    # 預先配置的接收緩衝區, 接收端用 recv_into 直接寫入, 解析端直接在同一塊記憶體上切封包
+    # 版面配置: [HEADROOM][資料區 .......................]
+    # 寫到資料區尾端時繞回 HEADROOM 開始寫, 尾端剩下不完整的封包 (< HEADROOM) 由解析端
+    # 搬到 HEADROOM 內緊接在新資料之前, 所以解析時看到的資料永遠是連續的
+    HEADROOM = 512
+    DEFAULT_CAPACITY = 1 << 20
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, chunk_size=4096):
+        self.capacity = capacity + ReceiveRingBuffer.HEADROOM
+        self.chunk_size = chunk_size
+        self.buf = bytearray(self.capacity)
+        self.view = memoryview(self.buf)
+        self.cond = threading.Condition()
+        self.read_pos = ReceiveRingBuffer.HEADROOM
+        self.write_pos = ReceiveRingBuffer.HEADROOM
+        self.wrap_pos = None
+        self.closed = False
+
+    def reset(self):
+        with self.cond:
+            self.read_pos = ReceiveRingBuffer.HEADROOM
+            self.write_pos = ReceiveRingBuffer.HEADROOM
+            self.wrap_pos = None
+            self.closed = False
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def is_empty(self):
+        with self.cond:
+            return self.wrap_pos is None and self.read_pos == self.write_pos
+
+    def used(self):
+        # 已收到、還沒解析的 bytes 數
+        with self.cond:
+            if self.wrap_pos is None:
+                return self.write_pos - self.read_pos
+            return self.wrap_pos - self.read_pos + self.write_pos - ReceiveRingBuffer.HEADROOM
+
+    def reserve(self, timeout=None):
+        # 取得一段可寫入的連續空間 (memoryview), 空間不足時等待解析端消化
+        with self.cond:
+            while not self.closed:
+                if self.wrap_pos is None:
+                    if self.capacity - self.write_pos >= self.chunk_size:
+                        return self.view[self.write_pos:self.capacity]
+                    if self.read_pos - ReceiveRingBuffer.HEADROOM > self.chunk_size:
+                        self.wrap_pos = self.write_pos
+                        self.write_pos = ReceiveRingBuffer.HEADROOM
+                        continue
+                elif self.read_pos - self.write_pos > self.chunk_size:
+                    return self.view[self.write_pos:self.read_pos]
+
+                if not self.cond.wait(timeout):
+                    return None
+            return None
+
+    def commit(self, size):
+        if size <= 0:
+            return
+        with self.cond:
+            self.write_pos += size
+            self.cond.notify_all()
+
+    def readable(self, timeout=None):
+        # 回傳目前可解析的連續區段 (start, end), 沒有資料時等待接收端
+        with self.cond:
+            while True:
+                if self.wrap_pos is not None:
+                    return self.read_pos, self.wrap_pos
+                if self.read_pos != self.write_pos:
+                    return self.read_pos, self.write_pos
+                if self.closed or not self.cond.wait(timeout):
+                    return None
+
+    def release(self, pos, end):
+        # 解析到 pos 為止; 若這段是繞回前的最後一段, 把剩下的半個封包搬到 HEADROOM
+        with self.cond:
+            if self.wrap_pos is not None and end == self.wrap_pos:
+                remain = end - pos
+                if remain > ReceiveRingBuffer.HEADROOM:
+                    log(f'drop {remain} bytes at wrap')
+                    remain = 0
+                start = ReceiveRingBuffer.HEADROOM - remain
+                self.buf[start:ReceiveRingBuffer.HEADROOM] = self.buf[end - remain:end]
+                self.read_pos = start
+                self.wrap_pos = None
+            else:
+                self.read_pos = pos
+            self.cond.notify_all()
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class SequenceTracker:
+    # 依封包內的 cnt (u16) 檢查是否掉資料, 一批一次向量化計算:
+    # - 與前一筆相差 1: 正常
+    # - 相差 0: 重複的封包, keep 為 False
+    # - 相差 2 ~ modulus / 2: 中間遺失 (相差 - 1) 筆
+    # - 其他 (往回跳): 視為裝置重新計數, 當作連續處理並記錄 resets
+    # 回傳的 index 為展開 wraparound 後的樣本序號, 第一筆為 0, 可以直接換算成時間
+    DEFAULT_MODULUS = 1 << 16
+
+    def __init__(self, modulus=DEFAULT_MODULUS):
+        self.modulus = modulus
+        self.last_cnt = None
+        self.last_index = -1
+        self.lost = 0
+        self.duplicates = 0
+        self.resets = 0
+
+    def reset(self):
+        self.last_cnt = None
+        self.last_index = -1
+        self.lost = 0
+        self.duplicates = 0
+        self.resets = 0
+
+    def update(self, cnt):
+        # 回傳 (index, keep, steps): keep 為非重複的封包, steps 為與前一筆的樣本差 (> 1 表示前面有遺失)
+        cnt = np.asarray(cnt, np.int64)
+        if len(cnt) == 0:
+            empty = np.empty(0, np.int64)
+            return empty, np.empty(0, bool), empty
+
+        previous = cnt[0] - 1 if self.last_cnt is None else self.last_cnt
+        steps = np.diff(cnt, prepend=previous) % self.modulus
+        duplicate = steps == 0
+        backward = steps > self.modulus // 2
+        steps[backward] = 1
+
+        lost = int(steps.sum() - np.count_nonzero(~duplicate))
+        if lost:
+            self.lost += lost
+        if duplicate.any():
+            self.duplicates += int(np.count_nonzero(duplicate))
+        if backward.any():
+            self.resets += int(np.count_nonzero(backward))
+
+        index = self.last_index + np.cumsum(steps)
+        self.last_cnt = int(cnt[-1])
+        self.last_index = int(index[-1])
+        return index, ~duplicate, steps
+
+
+def gap_marker_columns(columns):
+    # 開啟斷點標記時整數欄位一律轉成 float32 (與 recorder_dtypes 相同),
+    # 不論這一批有沒有插入 NaN, CSV 的格式都一致
+    return [column if column.dtype.kind == 'f' else column.astype(np.float32) for column in columns]
+
+
+def insert_gap_markers(timestamps, columns, steps, sample_period, previous_time=None):
+    # 在遺失資料的位置前插入一列 NaN, 繪圖 / 分析時可以看出斷點
+    # 時間為斷點前一筆 + 一個取樣週期; 兩筆之間不到一個週期時 (counter_time=False 時遺失的樣本不佔時間)
+    # 改放在兩筆的中間, 斷點的時間一定嚴格介於前後兩筆之間, Time 欄位不會重複或往回
+    # 時間戳不一定由 cnt 計算, 所以不能由 steps 往回推
+    # previous_time: 上一批最後一筆的時間, 這一批的第一筆前面就有遺失時使用
+    gaps = np.flatnonzero(steps > 1)
+    if len(gaps) == 0:
+        return timestamps, columns
+    before = np.append(timestamps[:1] - sample_period if previous_time is None else previous_time, timestamps)
+    previous, following = before[gaps], timestamps[gaps]
+    next_period = previous + sample_period
+    gap_times = np.where(next_period < following, next_period, (previous + following) / 2)
+    timestamps = np.insert(timestamps, gaps, gap_times)
+    columns = [np.insert(column, gaps, np.nan) for column in gap_marker_columns(columns)]
+    return timestamps, columns
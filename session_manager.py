@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from async_transport import AsyncGsensor, EventLoopThread
+from collector import DataCollector, decode_records, open_recorder
+from debug_log import log
+from private_formate import GesnsorInstruction
+
+# 一個 process 同時收多台感測器:
+# - 所有連線共用一個 event loop (EventLoopThread), 不再是每台一組 thread
+# - 解碼與寫檔交給共用的 thread pool, 同一台感測器同時只會有一批在處理, 確保寫入順序
+# - 每台感測器各自一個錄製檔, 時間軸以整個 session 的開始時間為 0, 各台之間可以直接對齊
+#   python session_manager.py 192.168.0.110:4061 192.168.0.111:4061 --mode raw --duration 60 --output-dir ./save_data/line1
+
+
+def parse_device(text):
+    host, _, port = text.rpartition(':')
+    if not host:
+        return text, 4061
+    return host, int(port)
+
+
+class SensorSession:
+    def __init__(self, host, port, data_mode, freq, file_path):
+        self.host = host
+        self.port = port
+        self.plot_method = data_mode
+        self.freq = freq
+        self.file_path = file_path
+
+        if self.plot_method == DataCollector.PlotMethod.RAW_DATA.value:
+            self.function_code = b'DA'
+            self.fields = DataCollector.RAW_FIELDS
+            self.header = DataCollector.RAW_HEADER
+        else:
+            self.function_code = b'AA'
+            self.fields = DataCollector.AA_FIELDS
+            self.header = DataCollector.AA_HEADER
+
+        self.sensor = AsyncGsensor(host, port, on_record=self.on_record)
+        self.records = []
+        self.first_time = None
+        self.offset = None
+        self.timestamp = 0
+        self.sample_count = 0
+        self.in_flight = None
+        self.recorder = None
+
+    @property
+    def name(self):
+        return f'{self.host}:{self.port}'
+
+    def on_record(self, function_code, record):
+        # 在 event loop 上執行, 只收集封包, 解碼交給 thread pool
+        if function_code == self.function_code:
+            if self.first_time is None:
+                self.first_time = time.monotonic()
+            self.records.append(record)
+        elif function_code == b'EV':
+            log(f'{self.name} {bytes(record)}')
+
+    def open_recorder(self):
+        self.recorder = open_recorder(self.file_path, self.fields, self.header, self.plot_method, self.freq)
+
+    def process_records(self, records, start_time):
+        # 在 thread pool 內執行; 第一筆封包的到達時間當作這台感測器的時間起點
+        columns, cnt = decode_records(records, self.fields)
+        count = len(cnt)
+        if count == 0:
+            return
+
+        if self.offset is None:
+            self.offset = self.first_time - start_time
+        sample_period = 1.0 / self.freq
+        timestamps = self.offset + self.timestamp + np.arange(count) * sample_period
+        self.timestamp += count * sample_period
+        self.sample_count += count
+
+        if self.recorder is not None:
+            self.recorder.write_block(timestamps, columns)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+
+class SessionManager:
+    DISPATCH_INTERVAL = 0.02
+    DECODE_WORKERS = min(4, os.cpu_count() or 1)
+
+    def __init__(self, devices, data_mode, freq, output_dir, extension='.csv', workers=DECODE_WORKERS):
+        self.data_mode = data_mode
+        self.freq = freq
+        self.output_dir = output_dir
+        self.extension = extension
+        self.loop_thread = EventLoopThread()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode')
+        self.sessions = [SensorSession(host, port, data_mode, freq,
+                                       os.path.join(output_dir, f'{host}_{port}{extension}'))
+                         for host, port in devices]
+        self.start_time = None
+        self.dispatch_task = None
+        self.is_collecting = False
+
+    def call(self, coro, timeout=GesnsorInstruction.TIME_OUT + 1):
+        try:
+            return self.loop_thread.run(coro, timeout)
+        except Exception as e:
+            log(f'{type(e).__name__}: {e}')
+            return None
+
+    async def connect_all(self):
+        results = await asyncio.gather(*[session.sensor.connect() for session in self.sessions],
+                                       return_exceptions=True)
+        for session, result in zip(self.sessions, results):
+            if isinstance(result, BaseException):
+                log(f'Connect Fail, {session.name}: {result}')
+        return [session for session in self.sessions if session.sensor.is_connect]
+
+    async def configure_all(self, sessions, rate=None):
+        async def configure(session):
+            if rate is not None:
+                await session.sensor.write_register(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE, rate)
+            freq = await session.sensor.read_register(GesnsorInstruction.GsenAddress.DATA_OUTPUT_RATE)
+            if freq:
+                session.freq = freq
+            else:
+                log(f'{session.name} DATA_OUTPUT_RATE read fail, use {session.freq} Hz')
+
+        results = await asyncio.gather(*[configure(session) for session in sessions], return_exceptions=True)
+        for session, result in zip(sessions, results):
+            if isinstance(result, BaseException):
+                log(f'{session.name} configure fail: {type(result).__name__}: {result}')
+
+    def connect(self, rate=None):
+        # 全部同時連線, 連不上的感測器從 session 移除
+        sessions = self.call(self.connect_all(), None) or []
+        self.sessions = sessions
+        if sessions:
+            self.call(self.configure_all(sessions, rate), None)
+        return len(self.sessions)
+
+    async def start_all(self):
+        self.start_time = time.monotonic()
+        self.dispatch_task = asyncio.get_running_loop().create_task(self.dispatch())
+        await asyncio.gather(*[session.sensor.start() for session in self.sessions], return_exceptions=True)
+
+    async def stop_all(self):
+        await asyncio.gather(*[session.sensor.stop() for session in self.sessions], return_exceptions=True)
+        if self.dispatch_task is not None:
+            self.dispatch_task.cancel()
+            self.dispatch_task = None
+        self.dispatch_once()
+
+    async def dispatch(self):
+        while True:
+            await asyncio.sleep(SessionManager.DISPATCH_INTERVAL)
+            self.dispatch_once()
+
+    def dispatch_once(self):
+        # 上一批還在處理的感測器先累積, 等下一輪再送, 同一台的資料依序寫入
+        for session in self.sessions:
+            if not session.records:
+                continue
+            if session.in_flight is not None and not session.in_flight.done():
+                continue
+            records, session.records = session.records, []
+            session.in_flight = self.pool.submit(self.process, session, records)
+
+    async def take_records(self, session):
+        # 在 event loop 上取走, 與 on_record 不會同時修改 session.records
+        records, session.records = session.records, []
+        return records
+
+    def process(self, session, records):
+        try:
+            session.process_records(records, self.start_time)
+        except Exception as e:
+            log(f'{session.name} {e}')
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        for session in self.sessions:
+            try:
+                session.open_recorder()
+            except Exception as e:
+                log(f'{session.name} Recorder Open Error: {e}')
+        self.is_collecting = True
+        self.call(self.start_all(), None)
+
+    def stop(self):
+        if not self.is_collecting:
+            return
+        self.is_collecting = False
+        self.call(self.stop_all(), None)
+        # 還在處理的那一批先寫完, 再把之後累積的封包依序寫入, 最後才關檔
+        for session in self.sessions:
+            if session.in_flight is not None:
+                session.in_flight.result()
+                session.in_flight = None
+            records = self.call(self.take_records(session), None)
+            if records:
+                self.process(session, records)
+            session.close()
+
+    def close(self):
+        self.stop()
+        for session in self.sessions:
+            self.loop_thread.call(session.sensor.close)
+        self.pool.shutdown()
+        self.loop_thread.close()
+
+    @property
+    def sample_count(self):
+        return sum(session.sample_count for session in self.sessions)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Collect from several G-sensors in one process')
+    parser.add_argument('devices', nargs='+', help='host[:port], port defaults to 4061')
+    parser.add_argument('--mode', choices=['raw', 'aa'], default='raw')
+    parser.add_argument('--rate', type=int, help='write DATA_OUTPUT_RATE on every device before recording')
+    parser.add_argument('--duration', type=float, default=0, help='seconds to record, 0 = until SIGINT/SIGTERM')
+    parser.add_argument('--output-dir', help='one <host>_<port> recording per device (default ./save_data/<time>)')
+    parser.add_argument('--format', choices=['csv', 'gsr'], default='csv')
+    parser.add_argument('--workers', type=int, default=SessionManager.DECODE_WORKERS)
+    parser.add_argument('--stats-interval', type=float, default=1.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_dir = args.output_dir or f'./save_data/{time.strftime("%Y%m%d_%H%M%S")}'
+    mode = DataCollector.PlotMethod.RAW_DATA.value if args.mode == 'raw' else DataCollector.PlotMethod.ALL_ACCEL.value
+
+    manager = SessionManager([parse_device(device) for device in args.devices], mode, args.rate or 2000,
+                             output_dir, '.' + args.format, args.workers)
+    if manager.connect(args.rate) == 0:
+        log(f'No device connected')
+        manager.close()
+        return 1
+
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+
+    print(f'recording {len(manager.sessions)} devices to {output_dir}', flush=True)
+    manager.start()
+    start = time.monotonic()
+    last_time = start
+    last_count = 0
+    while not stop_event.is_set():
+        timeout = args.stats_interval
+        if args.duration > 0:
+            timeout = min(timeout, max(start + args.duration - time.monotonic(), 0))
+        stop_event.wait(timeout)
+
+        now = time.monotonic()
+        count = manager.sample_count
+        if now > last_time:
+            print(f'{now - start:8.1f} s  {count:10d} samples  {(count - last_count) / (now - last_time):9.1f} samples/s',
+                  flush=True)
+        last_time = now
+        last_count = count
+
+        if args.duration > 0 and now - start >= args.duration:
+            break
+
+    manager.close()
+    for session in manager.sessions:
+        print(f'{session.name}: {session.sample_count} samples, offset {session.offset or 0:.4f} s -> {session.file_path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
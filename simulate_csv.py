@@ -1,51 +1,85 @@
-import csv
-from debug_log import log
 import time
 import threading
+import numpy as np
+from debug_log import log
+from private_formate import GesnsorInstruction
 
 class SimulateCsv:
-    def __init__(self, path, instruction):
-        self.csv_path = path 
+    # CSV 重播: 一次讀入整個檔案並編好所有 DA 指令, 依絕對時間表分批送出
+    # - rate: 目標樣本率 (Hz)
+    # - speed: 依 CSV 的 Time 欄位以 N 倍實際速度重播, 有給時優先於 rate
+    # 每一批送出的筆數由 (現在 - 開始時間) * rate 決定, sleep 誤差會在下一批補齊, 不會累積
+    DEFAULT_RATE = 2000
+    SEND_INTERVAL = 0.005
+    MAX_BATCH = 4096
+    SCALE = 8192
+    COUNTER_MODULUS = 10000
+
+    def __init__(self, path, instruction, rate=DEFAULT_RATE, speed=None):
+        self.csv_path = path
         self.instruction = instruction
+        self.rate = rate
+        self.speed = speed
         self.transmit_data_handle = threading.Thread(target=self.transmit_data, daemon=True)
         self.is_finish = False
-    
+        self.frames = b''
+        self.count = 0
+        self.sent = 0
+        self.achieved_rate = 0.0
+
+    def load(self):
+        # 欄位: Time, Accel_X, Accel_Y, Accel_Z (g), 換算成 s16 (x 8192)
+        values = np.loadtxt(self.csv_path, delimiter=',', skiprows=1, usecols=(0, 1, 2, 3), ndmin=2)
+        accel = np.clip(values[:, 1:4] * SimulateCsv.SCALE, -32768, 32767).astype(np.int16)
+        self.count = len(values)
+        cnt = np.arange(self.count) % SimulateCsv.COUNTER_MODULUS
+        self.frames = GesnsorInstruction.encode_accel_raw(accel[:, 0], accel[:, 1], accel[:, 2], cnt)
+
+        if self.speed and self.count > 1:
+            period = np.median(np.diff(values[:, 0]))
+            if period > 0:
+                self.rate = self.speed / period
+
     def transmit_data(self):
-        with open(self.csv_path, 'r') as file:
-            reader = csv.reader(file)
-            header = next(reader)  # skip header
-            count = 0
-            
-            for row in reader:
-                try:
-                    ax, ay, az = row[1:4]
-                    ax = int(float(ax) * 8192)
-                    ay = int(float(ay) * 8192)
-                    az = int(float(az) * 8192)
-                    # ax = int(ax)
-                    # ay = int(ay)
-                    # az = int(az)
-
-                    self.instruction.write_accel_raw(ax, ay, az, count)
-                    
-                    count += 1
-                    
-                    if (count % 5 == 0):
-                        time.sleep(0.001)
-                        
-                    if count >= 10000:
-                        count = 0
-                    
-                except Exception as e:
-                    log(f"{e}")
-                    break
-                
+        try:
+            self.load()
+        except Exception as e:
+            log(f"{e}")
+            self.is_finish = True
+            return
+
+        size = len(self.frames) // max(self.count, 1)
+        view = memoryview(self.frames)
+        start = time.monotonic()
+        deadline = start
+        while self.sent < self.count:
+            try:
+                target = min(int((time.monotonic() - start) * self.rate) + 1, self.count)
+                while self.sent < target:
+                    end = min(target, self.sent + SimulateCsv.MAX_BATCH)
+                    if not self.instruction.write_frames(view[self.sent * size:end * size]):
+                        raise ConnectionError(f'replay stopped, {self.count - self.sent} frames not sent')
+                    self.sent = end
+
+                deadline += SimulateCsv.SEND_INTERVAL
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = time.monotonic()
+            except Exception as e:
+                log(f"{e}")
+                break
+
+        elapsed = time.monotonic() - start
+        self.achieved_rate = self.sent / elapsed if elapsed > 0 else 0.0
+
         while self.instruction.is_send_finish() == False:
-            time.sleep(0.01)  
-            
-        log(f"Transmit finished! count = {count}")
+            time.sleep(0.01)
+
+        log(f"Transmit finished! count = {self.sent}, target {self.rate:.1f} Hz, achieved {self.achieved_rate:.1f} Hz")
         self.is_finish = True
-    
+
     def start_transmit_data(self):
         self.transmit_data_handle.start()
-        log("Transmit start!")
\ No newline at end of file
+        log("Transmit start!")
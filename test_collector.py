@@ -0,0 +1,14 @@
+import struct
+from collector import decode_records
+
+
+def da_record(cnt):
+    return struct.pack('<BB2shhhHB', 0x02, 0x0B, b'DA', 1, 2, 3, cnt, 0x03)
+
+
+def test_decode_records_skips_bad_lengths_with_matching_total():
+    # 12 + 14 bytes 的總長剛好等於兩筆 13 bytes 的封包
+    records = [da_record(1), da_record(2)[:12], da_record(3) + b'\x00']
+    columns, cnt = decode_records(records, ['acc_x'])
+    assert list(cnt) == [1]
+    assert list(columns[0]) == [1]
@@ -0,0 +1,52 @@
+import struct
+from concurrent.futures import Future
+from private_formate import PendingCommands
+
+
+def rm_ack(value):
+    return struct.pack('<BB2sIB', 0x02, 0x07, b'RM', value, 0x03)
+
+
+def parse_value(record):
+    return struct.unpack_from('<I', record, 4)[0]
+
+
+def send(pending):
+    future = Future()
+    pending.add(b'RM', future, parse_value)
+    return future
+
+
+def test_late_ack_is_dropped():
+    pending = PendingCommands()
+    first = send(pending)
+    first.cancel()
+    second = send(pending)
+    assert pending.resolve(rm_ack(1))
+    assert not second.done()
+    assert pending.resolve(rm_ack(2))
+    assert second.result() == 2
+    assert len(pending) == 0
+
+
+def test_lost_ack_does_not_shift_later_commands():
+    pending = PendingCommands()
+    lost = send(pending)
+    lost.cancel()
+    # 吞掉 second 的 ack 後 second 逾時, 之後的指令不能再錯開
+    second = send(pending)
+    pending.resolve(rm_ack(11))
+    second.cancel()
+    for value in (22, 33):
+        future = send(pending)
+        assert pending.resolve(rm_ack(value))
+        assert future.result() == value
+    assert len(pending) == 0
+
+
+def test_expired_cancelled_command_is_pruned():
+    pending = PendingCommands(max_age=0)
+    send(pending).cancel()
+    future = send(pending)
+    assert pending.resolve(rm_ack(5))
+    assert future.result() == 5
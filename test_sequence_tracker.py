@@ -0,0 +1,56 @@
+import numpy as np
+from sequence_tracker import SequenceTracker, insert_gap_markers
+
+
+def test_update_counts_lost_and_duplicates():
+    tracker = SequenceTracker()
+    index, keep, steps = tracker.update([0, 1, 1, 5, 6])
+    assert list(index) == [0, 1, 1, 5, 6]
+    assert list(keep) == [True, True, False, True, True]
+    assert tracker.lost == 3
+    assert tracker.duplicates == 1
+
+
+def test_update_unwraps_counter():
+    tracker = SequenceTracker(modulus=10)
+    tracker.update([7, 8, 9])
+    index, _, _ = tracker.update([0, 1])
+    assert list(index) == [3, 4]
+    assert tracker.lost == 0
+
+
+def test_gap_marker_time_without_counter_time():
+    # counter_time=False: 遺失的樣本不佔時間, 斷點放在前後兩筆的中間
+    steps = np.array([1, 1, 4, 1])
+    timestamps = np.arange(4) * 0.001
+    times, columns = insert_gap_markers(timestamps, [np.arange(4, dtype=np.int16)], steps, 0.001)
+    assert np.allclose(times, [0, 0.001, 0.0015, 0.002, 0.003])
+    assert np.all(np.diff(times) > 0)
+    assert np.isnan(columns[0][2])
+
+
+def test_gap_marker_time_with_counter_time():
+    steps = np.array([1, 1, 4, 1])
+    timestamps = np.array([0, 1, 5, 6]) * 0.001
+    times, columns = insert_gap_markers(timestamps, [np.zeros(4)], steps, 0.001)
+    assert np.allclose(times, [0, 0.001, 0.002, 0.005, 0.006])
+    assert np.isnan(columns[0][2])
+
+
+def test_gap_marker_at_batch_start_uses_previous_time():
+    steps = np.array([3, 1])
+    timestamps = np.array([0.010, 0.011])
+    times, _ = insert_gap_markers(timestamps, [np.zeros(2)], steps, 0.001, previous_time=0.009)
+    assert np.allclose(times, [0.010, 0.010, 0.011])
+    assert np.all(np.diff(times) > 0)
+
+
+def test_gap_marker_time_is_strictly_increasing():
+    # 時間戳由累加而來時 前一筆 + 週期 可能因浮點誤差略大於下一筆
+    sample_period = 1 / 3000
+    timestamps = np.cumsum(np.full(3000, sample_period))
+    steps = np.where(np.arange(3000) % 7 == 3, 2, 1)
+    times, columns = insert_gap_markers(timestamps, [np.arange(3000, dtype=np.int16)], steps, sample_period,
+                                        previous_time=0.0)
+    assert np.all(np.diff(times) > 0)
+    assert columns[0].dtype == np.float32
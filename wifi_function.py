@@ -2,19 +2,30 @@
 import time
 import threading
 import socket
-from debug_log import log
+from debug_log import log, WARNING
 import queue
+from ring_buffer import ReceiveRingBuffer
+from metrics import metrics
+from bounded_queue import BoundedQueue
 
 class WifiFunction:
     MAX_TIME_OUT = 0.1
+    DEFAULT_RCVBUF_SIZE = 1 << 20
+    SEND_CHUNK = 64 << 10
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, rcvbuf_size=DEFAULT_RCVBUF_SIZE):
         self.is_connect = False
         self.sock = None
         self.host = host
         self.port = port
-        self.send_buf = queue.Queue()
-        self.read_buf = queue.Queue()
+        self.rcvbuf_size = rcvbuf_size
+        self.connected = threading.Event()
+        self.connect_count = 0
+        self.send_buf = BoundedQueue('send')
+        self.read_ring = ReceiveRingBuffer()
+        self.recv_bytes = metrics.counter('recv.bytes')
+        self.sent_bytes = metrics.counter('send.bytes')
+        metrics.gauge('ring.used', self.read_ring.used)
         self.send_process_handle = threading.Thread(target=self.send_process, daemon=True)
         self.received_process_handle = threading.Thread(target=self.received_process, daemon=True)
         self.send_process_handle.start()
@@ -23,80 +34,135 @@ class WifiFunction:
     def connect(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # 連線前設定接收緩衝區, TCP window scaling 才會依照這個大小協商
+            if self.rcvbuf_size:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_size)
             self.sock.settimeout(WifiFunction.MAX_TIME_OUT)
             self.sock.connect((self.host, self.port))
             self.sock.setblocking(True)
+            self.read_ring.reset()
             time.sleep(1)
             self.is_connect = True
+            self.connect_count += 1
+            self.connected.set()
             return True
         except Exception as e:
             log(f'{e}')
             self.sock = None
             self.is_connect = False
 
-    def write_data(self, data):
+    def close(self):
+        # shutdown 會讓卡在 recv_into 的 received_process 立即返回
+        self.is_connect = False
+        self.connected.clear()
+        sock = self.sock
+        self.sock = None
+        if sock is None:
+            return
+
         try:
-            self.send_buf.put(data, True, WifiFunction.MAX_TIME_OUT)
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def write_data(self, data, timeout=MAX_TIME_OUT):
+        # 放進 send_buf 成功時回傳 True
+        # timeout 為 None 時一直等到 send_buf 有空間 (資料回放 / 批次送出), 只有斷線時才放棄
+        try:
+            if timeout is None:
+                if self.send_buf.put_while(data, lambda: self.is_connect, WifiFunction.MAX_TIME_OUT):
+                    return True
+            else:
+                self.send_buf.put(data, True, timeout)
+                return True
+        except queue.Full:
+            pass
         except Exception as e:
             log(f'{e}')
+            return False
+        log('send_buf full, drop command', level=WARNING)
+        return False
 
     def read_data(self):
-        data = self.read_buf.get()
+        start, end = self.read_ring.readable(None)
+        data = bytes(self.read_ring.view[start:end])
+        self.read_ring.release(end, end)
         return data
 
     def received_process(self):
         while True:
             try:
-                if (self.is_connect == False) or (self.sock is None):
-                    time.sleep(0.05)
+                self.connected.wait()
+                sock = self.sock
+                if sock is None:
                     continue
 
-                data = self.sock.recv(4096)
-                # print([f'{b:02X}' for b in data])
-                if len(data) > 0:
-                    self.read_buf.put(data, True, WifiFunction.MAX_TIME_OUT)
-                time.sleep(0.01)
+                view = self.read_ring.reserve(WifiFunction.MAX_TIME_OUT)
+                if view is None:
+                    continue
 
-            except socket.timeout:
-                log("接收超時")
+                size = sock.recv_into(view)
+                del view
+                if size == 0:
+                    if self.is_connect:
+                        log("連線已被對方關閉")
+                        self.close()
+                    continue
+
+                self.read_ring.commit(size)
+                self.recv_bytes.add(size)
 
             except ConnectionResetError:
                 log("連線被對方強制關閉 (RST)")
-                break
+                self.close()
 
             except ConnectionAbortedError:
                 log("連線被本地或中間設備中止")
-                break
+                self.close()
 
             except OSError as e:
-                log(f"其他 socket 錯誤: {e}")
-                break
+                if self.is_connect:
+                    log(f"其他 socket 錯誤: {e}")
+                    self.close()
 
     def send_process(self):
         while True:
-            data = bytearray()
+            # 沒有連線時等待, 不要空轉
+            self.connected.wait()
             try:
-                while True:
-                    if self.sock ==  None:
-                        break
-                    try:
-                        temp = self.send_buf.get(timeout=0.01)
-                        data += temp
-                        # if isinstance(temp, (bytes, bytearray)):
-                        #     data += temp
-
-                        if len(data) > 500:
-                            break
+                data = self.send_buf.get(timeout=WifiFunction.MAX_TIME_OUT)
+            except queue.Empty:
+                continue
 
-                    except queue.Empty:
-                        break
+            # 取出的項目在 sendall 完成 (或失敗) 後才 task_done, is_send_finish 才看得到送到一半的資料
+            taken = 1
+            try:
+                # 小指令合併到 SEND_CHUNK 再送, 已經夠大的區塊 (例如 write_accel_raw_batch) 直接送, 不另外複製
+                if len(data) < WifiFunction.SEND_CHUNK:
+                    data = bytearray(data)
+                    while len(data) < WifiFunction.SEND_CHUNK:
+                        try:
+                            data += self.send_buf.get_nowait()
+                            taken += 1
+                        except queue.Empty:
+                            break
 
-                if len(data) > 0:
-                    self.sock.send(data)
-                    # log(f"Send {len(data)} bytes")
+                sock = self.sock
+                if sock is None:
+                    continue
+                # sendall 會處理 partial send, 一直送到整個區塊都寫入 socket
+                sock.sendall(data)
+                self.sent_bytes.add(len(data))
 
             except OSError as e:
-                if e.winerror == 10038:
-                    print("嘗試對非 socket 的對象做操作（可能已關閉或是變數錯誤）")
-                else:
-                    print(f"其他 OSError: {e}")
+                if self.is_connect:
+                    log(f"傳送失敗: {e}")
+                    self.close()
+            finally:
+                for _ in range(taken):
+                    self.send_buf.task_done()
+
+    def is_send_finish(self):
+        # send_buf 內排隊中與 send_process 正在 sendall 的資料都送出後才算完成; 斷線後不會再送出, 也視為完成
+        return not self.is_connect or self.send_buf.unfinished_tasks == 0